@@ -121,12 +121,15 @@ def placements_to_outcome(placements: np.ndarray, outcome: str) -> tuple[np.ndar
     """
     Convert placement (1..8) to an outcome vector.
 
+    Works directly on the engine's int8 placements; every branch fits in int8 and
+    is cast to float32 exactly once.
+
     Returns:
       y: np.ndarray[float32]
       kind: "binary" | "continuous"
     """
     outcome = (outcome or "").strip().lower()
-    p = placements.astype(np.int16, copy=False)
+    p = placements
     if outcome in ("top4", "top_4", "topfour"):
         return (p <= 4).astype(np.float32), "binary"
     if outcome in ("win", "first", "1st"):
@@ -217,9 +220,13 @@ def aipw_ate(
     mu0_hat = np.empty((n,), dtype=np.float64)
 
     kf = KFold(n_splits=n_splits, shuffle=True, random_state=cfg.random_state)
-    for train_idx, test_idx in kf.split(np.arange(n)):
-        X_tr = X[train_idx]
-        X_te = X[test_idx]
+    splits = list(kf.split(np.arange(n)))
+    # Each fold's rows are gathered once. With two folds the training rows of one fold are
+    # exactly the (ascending) test rows of the other, so those gathers are shared too.
+    X_folds = [X[test_idx] for _, test_idx in splits]
+    for k, (train_idx, test_idx) in enumerate(splits):
+        X_tr = X_folds[1 - k] if n_splits == 2 else X[train_idx]
+        X_te = X_folds[k]
         T_tr = T[train_idx]
         y_tr = y[train_idx]
 
@@ -20,7 +20,12 @@ import orjson
 from pyroaring import BitMap
 
 from .engine import GraphEngine
-from .features import TokenFeatureParams, build_sparse_feature_matrix, select_feature_tokens
+from .features import (
+    TokenFeatureParams,
+    build_sparse_feature_matrix,
+    feature_cluster_counts,
+    select_feature_tokens,
+)
 
 
 @dataclass(frozen=True, slots=True)
@@ -155,7 +160,7 @@ def _global_base_stats(engine: GraphEngine) -> dict:
         if n == int(engine.placements.size):
             placements = engine.placements.astype(np.int16, copy=False)
         else:
-            ids = np.array(engine.all_players.to_array(), dtype=np.int64)
+            ids = np.frombuffer(engine.all_players.to_array(), dtype=np.uint32)
             placements = engine.placements[ids].astype(np.int16, copy=False)
 
         placements = np.clip(placements, 0, 8)
@@ -297,7 +302,7 @@ def compute_clusters(engine: GraphEngine, tokens: list[str], params: ClusterPara
 
     base = engine.filter_bitmap(list(canonical_include), list(canonical_exclude))
     n_base = len(base)
-    base_ids = np.array(base.to_array(), dtype=np.int64)
+    base_ids = np.frombuffer(base.to_array(), dtype=np.uint32)
     base_avg = float(engine.avg_placement_for_bitmap(base)) if n_base > 0 else 4.5
     base_hist = _placement_hist(engine, base_ids)
     base_rates = _rates_from_hist(base_hist)
@@ -332,7 +337,7 @@ def compute_clusters(engine: GraphEngine, tokens: list[str], params: ClusterPara
         return result
 
     features = _select_features(engine, params)
-    X, kept_features, base_counts, feature_rows = build_sparse_feature_matrix(
+    X, kept_features, base_counts, _feature_rows = build_sparse_feature_matrix(
         engine, base, base_ids, features
     )
 
@@ -360,9 +365,7 @@ def compute_clusters(engine: GraphEngine, tokens: list[str], params: ClusterPara
     base_freq = base_counts.astype(np.float32) / float(n_base)
 
     # Precompute counts(feature present) per cluster for each feature.
-    feature_cluster_counts = np.zeros((params.n_clusters, len(kept_features)), dtype=np.int32)
-    for j, rows in enumerate(feature_rows):
-        feature_cluster_counts[:, j] = np.bincount(labels[rows], minlength=params.n_clusters)
+    cluster_feature_counts = feature_cluster_counts(X, labels, params.n_clusters)
 
     clusters: list[dict] = []
     members_by_cluster_id: dict[int, BitMap] = {}
@@ -381,7 +384,7 @@ def compute_clusters(engine: GraphEngine, tokens: list[str], params: ClusterPara
         rates = _rates_from_hist(hist)
         delta_vs_base = avg_placement - base_avg
 
-        cluster_counts = feature_cluster_counts[c].astype(np.float32, copy=False)
+        cluster_counts = cluster_feature_counts[c].astype(np.float32, copy=False)
         cluster_freq = cluster_counts / float(size)
         with np.errstate(divide="ignore", invalid="ignore"):
             lift = np.where(base_freq > 0, cluster_freq / base_freq, 0.0)
@@ -525,7 +528,7 @@ def compute_cluster_playbook(
             "killers": [],
         }
 
-    cluster_ids = np.array(cluster_bm.to_array(), dtype=np.int64)
+    cluster_ids = np.frombuffer(cluster_bm.to_array(), dtype=np.uint32)
     placements = engine.placements[cluster_ids].astype(np.int16, copy=False)
     placements = np.clip(placements, 0, 8)
     n = int(placements.size)
@@ -661,7 +664,7 @@ def compute_cluster_playbook(
         if n_with < min_with or n_without < min_without:
             continue
 
-        with_ids = np.array(with_bm.to_array(), dtype=np.int64)
+        with_ids = np.frombuffer(with_bm.to_array(), dtype=np.uint32)
         with_places = engine.placements[with_ids].astype(np.int16, copy=False)
         with_places = np.clip(with_places, 0, 8)
 
@@ -1060,7 +1063,7 @@ def compute_token_stats(engine: GraphEngine, tokens: list[str]) -> dict:
     else:
         base = engine.filter_bitmap(list(canonical_include), list(canonical_exclude))
     n_base = int(len(base))
-    base_ids = np.array(base.to_array(), dtype=np.int64) if n_base > 0 else np.array([], dtype=np.int64)
+    base_ids = np.frombuffer(base.to_array(), dtype=np.uint32)
     base_avg = float(engine.avg_placement_for_bitmap(base)) if n_base > 0 else 4.5
     base_hist = _placement_hist(engine, base_ids)
     base_rates = _rates_from_hist(base_hist)
@@ -1271,7 +1274,7 @@ def compute_token_playbook(
             },
         }
 
-    base_ids = np.array(base.to_array(), dtype=np.int64)
+    base_ids = np.frombuffer(base.to_array(), dtype=np.uint32)
     cluster = _token_cluster_summary(engine, base, base_ids, params, run_id)
 
     cluster_ids = base_ids
@@ -1409,7 +1412,7 @@ def compute_token_playbook(
         if n_with < min_with or n_without < min_without:
             continue
 
-        with_ids = np.array(with_bm.to_array(), dtype=np.int64)
+        with_ids = np.frombuffer(with_bm.to_array(), dtype=np.uint32)
         with_places = engine.placements[with_ids].astype(np.int16, copy=False)
         with_places = np.clip(with_places, 0, 8)
 
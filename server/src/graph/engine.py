@@ -18,12 +18,30 @@ import numpy as np
 import orjson
 from pyroaring import BitMap
 
-from .items import get_item_type
+from .items import get_item_prefix, get_item_type
 
 # Type aliases
 TokenId = int
 PlayerId = int  # player_match_id
 
+# Packed per-token row of the top4 necessity cache (one read per token on the request path).
+NECESSITY_TOP4_STATS_DTYPE = np.dtype(
+    [
+        ("tau", np.float32),
+        ("ci95_low", np.float32),
+        ("ci95_high", np.float32),
+        ("se", np.float32),
+        ("raw_tau", np.float32),
+        ("frac_trimmed", np.float32),
+        ("e_p01", np.float32),
+        ("e_p99", np.float32),
+        ("n_treated", np.int32),
+        ("n_control", np.int32),
+        ("n_used", np.int32),
+        ("scope_min_star", np.uint8),
+    ]
+)
+
 
 @dataclass(slots=True)
 class TokenStats:
@@ -79,6 +97,22 @@ class GraphEngine:
         'necessity_top4_n_control',
         'necessity_top4_n_used',
         'necessity_top4_scope_min_star',
+        'necessity_top4_stats',
+        # Derived lookups rebuilt after build/load (not persisted)
+        'unit_all_bm',
+        'unit_star2plus_bm',
+        'unit_star_counts',
+        'item_type_by_tokenid',
+        'item_prefix_by_tokenid',
+        'item_name_by_tokenid',
+        'equipped_copies_by_tokenid',
+        'equipped_ids_by_unit',
+        'equipped_ids_by_item',
+        'equipped_ids_by_type',
+        'equipped_ids_by_prefix',
+        'equipped_copy_ids',
+        'equipped_holders_by_item',
+        'unit_equip_index',
     )
 
     def __init__(self):
@@ -97,6 +131,7 @@ class GraphEngine:
         self.three_star_count: np.ndarray | None = None
         self.unit_gold_value: np.ndarray | None = None
         self.necessity_top4_ready: bool = False
+        # Per-field views into necessity_top4_stats (see bind_necessity_fields_top4)
         self.necessity_top4_tau: np.ndarray | None = None
         self.necessity_top4_ci95_low: np.ndarray | None = None
         self.necessity_top4_ci95_high: np.ndarray | None = None
@@ -109,23 +144,143 @@ class GraphEngine:
         self.necessity_top4_n_control: np.ndarray | None = None
         self.necessity_top4_n_used: np.ndarray | None = None
         self.necessity_top4_scope_min_star: np.ndarray | None = None
+        self.necessity_top4_stats: np.ndarray | None = None
+        self.unit_all_bm: dict[str, BitMap] = {}
+        self.unit_star2plus_bm: dict[str, BitMap] = {}
+        self.unit_star_counts: dict[str, tuple[int, int]] = {}
+        # Item metadata for I:/E: tokens (None for other token types)
+        self.item_type_by_tokenid: list[str | None] = []
+        self.item_prefix_by_tokenid: list[str | None] = []
+        self.item_name_by_tokenid: list[str | None] = []
+        self.equipped_copies_by_tokenid: np.ndarray = np.zeros((0,), dtype=np.int8)  # 0 = not E:
+        # Equipped (E:) token-id sets for candidate filtering (prefix keys are lowercase)
+        self.equipped_ids_by_unit: dict[str, BitMap] = {}
+        self.equipped_ids_by_item: dict[str, BitMap] = {}  # item name -> E: ids (all copy counts)
+        self.equipped_ids_by_type: dict[str, BitMap] = {}
+        self.equipped_ids_by_prefix: dict[str, BitMap] = {}
+        self.equipped_copy_ids: BitMap = BitMap()  # E:Unit|Item:N tokens (N >= 2)
+        # item -> [(unit, "E:Unit|Item", token_id)] for single-copy holders, in U: token order
+        self.equipped_holders_by_item: dict[str, list[tuple[str, str, int]]] = {}
+        # unit -> [(token_id, is_component)] for single-copy E:Unit|Item tokens, in id order
+        self.unit_equip_index: dict[str, list[tuple[int, bool]]] = {}
+
+    def build_indexes(self) -> None:
+        """
+        Build derived per-unit and per-token lookups used on the request path.
+
+        These are cheap to rebuild from the token bitmaps, so they are not stored in engine.bin.
+        """
+        unit_all_bm: dict[str, BitMap] = {}
+        unit_star2plus_bm: dict[str, BitMap] = {}
+        unit_star_counts: dict[str, tuple[int, int]] = {}
+
+        for token_id, token_str in enumerate(self.id_to_token):
+            if not token_str.startswith("U:") or token_str.count(":") != 1:
+                continue
+            stats = self.tokens.get(token_id)
+            if stats is None:
+                continue
+            unit = token_str[2:]
+
+            star2plus_bm = BitMap()
+            for s in range(2, 7):
+                star_id = self.token_to_id.get(f"U:{unit}:{s}")
+                star_stats = self.tokens.get(star_id) if star_id is not None else None
+                if star_stats is not None:
+                    star2plus_bm |= star_stats.bitmap
+
+            unit_all_bm[unit] = stats.bitmap
+            unit_star2plus_bm[unit] = star2plus_bm
+            unit_star_counts[unit] = (len(stats.bitmap), stats.bitmap.intersection_cardinality(star2plus_bm))
+
+        self.unit_all_bm = unit_all_bm
+        self.unit_star2plus_bm = unit_star2plus_bm
+        self.unit_star_counts = unit_star_counts
+
+        n_tokens = len(self.id_to_token)
+        item_type_by_tokenid: list[str | None] = [None] * n_tokens
+        item_prefix_by_tokenid: list[str | None] = [None] * n_tokens
+        item_name_by_tokenid: list[str | None] = [None] * n_tokens
+        equipped_copies_by_tokenid = np.zeros((n_tokens,), dtype=np.int8)
+        equipped_ids_by_unit: dict[str, BitMap] = {}
+        equipped_ids_by_item: dict[str, BitMap] = {}
+        equipped_ids_by_type: dict[str, BitMap] = {}
+        equipped_ids_by_prefix: dict[str, BitMap] = {}
+        equipped_copy_ids = BitMap()
+        equipped_holders_by_item: dict[str, list[tuple[str, str, int]]] = {}
+        unit_equip_index: dict[str, list[tuple[int, bool]]] = {}
+        for token_id, token_str in enumerate(self.id_to_token):
+            is_equipped = False
+            if token_str.startswith("I:"):
+                item_name = token_str[2:]
+            elif token_str.startswith("E:") and "|" in token_str:
+                is_equipped = True
+                unit, item_name = token_str[2:].split("|", 1)
+                # Strip the optional copy-count suffix: E:Unit|Item:2 / :3
+                copies = 1
+                base, _, maybe_copies = item_name.rpartition(":")
+                if base and maybe_copies.isdigit() and int(maybe_copies) >= 2:
+                    item_name = base
+                    copies = int(maybe_copies)
+                    equipped_copy_ids.add(token_id)
+                equipped_copies_by_tokenid[token_id] = min(copies, 127)
+            else:
+                continue
+            item_type = get_item_type(item_name)
+            item_prefix = get_item_prefix(item_name)
+            item_type_by_tokenid[token_id] = item_type
+            item_prefix_by_tokenid[token_id] = item_prefix
+            item_name_by_tokenid[token_id] = item_name
+
+            if is_equipped:
+                if token_id not in equipped_copy_ids:
+                    unit_equip_index.setdefault(unit, []).append((token_id, item_type == "component"))
+                    if unit in unit_all_bm:
+                        equipped_holders_by_item.setdefault(item_name, []).append((unit, token_str, token_id))
+                equipped_ids_by_unit.setdefault(unit, BitMap()).add(token_id)
+                equipped_ids_by_item.setdefault(item_name, BitMap()).add(token_id)
+                equipped_ids_by_type.setdefault(item_type, BitMap()).add(token_id)
+                if item_prefix:
+                    equipped_ids_by_prefix.setdefault(item_prefix.lower(), BitMap()).add(token_id)
+
+        self.item_type_by_tokenid = item_type_by_tokenid
+        self.item_prefix_by_tokenid = item_prefix_by_tokenid
+        self.item_name_by_tokenid = item_name_by_tokenid
+        self.equipped_copies_by_tokenid = equipped_copies_by_tokenid
+        self.equipped_ids_by_unit = equipped_ids_by_unit
+        self.equipped_ids_by_item = equipped_ids_by_item
+        self.equipped_ids_by_type = equipped_ids_by_type
+        self.equipped_ids_by_prefix = equipped_ids_by_prefix
+        self.equipped_copy_ids = equipped_copy_ids
+        self.unit_equip_index = unit_equip_index
+
+        unit_order = {unit: i for i, unit in enumerate(unit_all_bm)}
+        for holders in equipped_holders_by_item.values():
+            holders.sort(key=lambda h: unit_order[h[0]])
+        self.equipped_holders_by_item = equipped_holders_by_item
 
     def init_necessity_cache_top4(self) -> None:
         """Initialize in-memory arrays for the top4 necessity cache (engine.bin v3+)."""
         n_tokens = len(self.id_to_token)
-        self.necessity_top4_tau = np.full((n_tokens,), np.nan, dtype=np.float32)
-        self.necessity_top4_ci95_low = np.full((n_tokens,), np.nan, dtype=np.float32)
-        self.necessity_top4_ci95_high = np.full((n_tokens,), np.nan, dtype=np.float32)
-        self.necessity_top4_se = np.full((n_tokens,), np.nan, dtype=np.float32)
-        self.necessity_top4_raw_tau = np.full((n_tokens,), np.nan, dtype=np.float32)
-        self.necessity_top4_frac_trimmed = np.full((n_tokens,), np.nan, dtype=np.float32)
-        self.necessity_top4_e_p01 = np.full((n_tokens,), np.nan, dtype=np.float32)
-        self.necessity_top4_e_p99 = np.full((n_tokens,), np.nan, dtype=np.float32)
-        self.necessity_top4_n_treated = np.zeros((n_tokens,), dtype=np.int32)
-        self.necessity_top4_n_control = np.zeros((n_tokens,), dtype=np.int32)
-        self.necessity_top4_n_used = np.zeros((n_tokens,), dtype=np.int32)
-        # 0 = unknown/unset; 1..6 = min star level for unit scope used to compute the estimate.
-        self.necessity_top4_scope_min_star = np.zeros((n_tokens,), dtype=np.uint8)
+        # Integer fields start at 0; for scope_min_star 0 = unknown/unset and 1..6 = min
+        # star level for the unit scope used to compute the estimate.
+        stats = np.zeros((n_tokens,), dtype=NECESSITY_TOP4_STATS_DTYPE)
+        for name in NECESSITY_TOP4_STATS_DTYPE.names:
+            if NECESSITY_TOP4_STATS_DTYPE[name].kind == "f":
+                stats[name] = np.nan
+        self.necessity_top4_stats = stats
+        self.bind_necessity_fields_top4()
+
+    def bind_necessity_fields_top4(self) -> None:
+        """
+        Point the per-field `necessity_top4_*` arrays at columns of `necessity_top4_stats`.
+
+        The packed record array is the only storage: writes through a field view land in
+        the row readers gather with `necessity_top4_stats[token_id].item()`.
+        """
+        stats = self.necessity_top4_stats
+        for name in NECESSITY_TOP4_STATS_DTYPE.names:
+            setattr(self, f"necessity_top4_{name}", stats[name] if stats is not None else None)
 
     def precompute_necessity_cache_top4(
         self,
@@ -158,13 +313,12 @@ class GraphEngine:
         from .causal import AIPWConfig, OverlapError, aipw_ate, placements_to_outcome
         from .features import (
             TokenFeatureParams,
+            append_dense_columns,
             build_sparse_feature_matrix,
             board_strength_features,
             select_feature_tokens,
         )
 
-        from scipy.sparse import csr_matrix, hstack
-
         if self.placements is None or not self.id_to_token:
             raise ValueError("Engine must be built/loaded before precomputing necessity cache")
 
@@ -202,21 +356,10 @@ class GraphEngine:
                 continue
 
             scope_min_star = 1
-            star2plus_bm = BitMap()
+            star2plus_bm = self.unit_star2plus_bm.get(unit)
             if auto_unit_stars_min:
-                for s in range(2, 7):
-                    star_tok = f"U:{unit}:{s}"
-                    token_id = self.token_to_id.get(star_tok)
-                    if token_id is None:
-                        continue
-                    stats = self.tokens.get(token_id)
-                    if stats is None:
-                        continue
-                    star2plus_bm |= stats.bitmap
-
                 if star2plus_bm:
-                    n_all = len(base_bitmap_full)
-                    n_2p = len(base_bitmap_full & star2plus_bm)
+                    n_all, n_2p = self.unit_star_counts[unit]
                     if n_all > 0 and n_2p >= star2plus_min_rows and (n_2p / float(n_all)) >= star2plus_share_threshold:
                         scope_min_star = 2
 
@@ -227,80 +370,63 @@ class GraphEngine:
             if n_base_full < max(500, min_group * 3):
                 continue
 
-            base_ids_full = np.array(base_bitmap_full.to_array(), dtype=np.int64)
+            base_ids_full = np.frombuffer(base_bitmap_full.to_array(), dtype=np.uint32)
             base_bitmap_model = base_bitmap_full
             base_ids = base_ids_full
             if max_rows_per_unit is not None and base_ids_full.size > int(max_rows_per_unit):
                 sel = rng.choice(base_ids_full.size, size=int(max_rows_per_unit), replace=False)
-                base_ids = np.sort(base_ids_full[sel])
+                # base_ids_full is ascending, so sorted positions keep base_ids sorted.
+                sel.sort()
+                base_ids = base_ids_full[sel]
                 base_bitmap_model = BitMap(base_ids)
 
-            placements = self.placements[base_ids].astype(np.int16, copy=False)
+            placements = self.placements[base_ids]
             y, kind = placements_to_outcome(placements, "top4")
 
             feature_tokens = [t for t in feature_pool if t != unit_token]
             X_tok, _, _, _ = build_sparse_feature_matrix(self, base_bitmap_model, base_ids, feature_tokens)
 
             # Board-strength proxy features (rest-of-board counts).
-            Z_full = board_strength_features(self, base_ids).astype(np.float32, copy=False)
-            unit_item_count = np.zeros((base_ids.size,), dtype=np.float32)
-            unit_component_count = np.zeros((base_ids.size,), dtype=np.float32)
-            unit_completed_count = np.zeros((base_ids.size,), dtype=np.float32)
+            Z_full = board_strength_features(self, base_ids)
+            component_rows: list[np.ndarray] = []
+            completed_rows: list[np.ndarray] = []
 
-            prefix = f"E:{unit}|"
-            equipped_tokens = [t for t in self.id_to_token if t.startswith(prefix)]
+            # All equipped tokens (any copy count) feed the rest-of-board counts; only the
+            # base ">=1 copy" token gets an AIPW estimate.
             equipped_token_ids: list[int] = []
-            for eq_tok in equipped_tokens:
-                # Parse optional copy-count suffix: E:Unit|Item:2 / :3
-                item_part = eq_tok.split("|", 1)[1] if "|" in eq_tok else ""
-                item_name = item_part
-                copies = 1
-                if ":" in item_part:
-                    base, maybe_copies = item_part.rsplit(":", 1)
-                    try:
-                        c = int(maybe_copies)
-                    except ValueError:
-                        c = None
-                    if c is not None and c >= 2:
-                        copies = c
-                        item_name = base
-
-                tok_id = self.token_to_id.get(eq_tok)
-                tok_stats = self.tokens.get(tok_id) if tok_id is not None else None
-                if tok_id is None or tok_stats is None:
+            for tok_id in self.equipped_ids_by_unit.get(unit) or ():
+                tok_stats = self.tokens.get(tok_id)
+                if tok_stats is None:
                     continue
-                # Only compute AIPW τ for the base ">=1 copy" equipped token.
-                if copies == 1:
+                if tok_id not in self.equipped_copy_ids:
                     equipped_token_ids.append(int(tok_id))
 
                 bm = base_bitmap_model & tok_stats.bitmap
                 if not bm:
                     continue
-                ids = np.array(bm.to_array(), dtype=np.int64)
-                rows = np.searchsorted(base_ids, ids).astype(np.int64, copy=False)
-                unit_item_count[rows] += 1.0
-
-                if get_item_type(item_name) == "component":
-                    unit_component_count[rows] += 1.0
+                ids = np.frombuffer(bm.to_array(), dtype=np.uint32)
+                rows = np.searchsorted(base_ids, ids)
+                if self.item_type_by_tokenid[tok_id] == "component":
+                    component_rows.append(rows)
                 else:
-                    unit_completed_count[rows] += 1.0
-
-            other_item_count = np.clip(Z_full[:, 0] - unit_item_count, 0.0, None)
-            other_component_count = np.clip(Z_full[:, 1] - unit_component_count, 0.0, None)
-            other_completed_count = np.clip(Z_full[:, 2] - unit_completed_count, 0.0, None)
-            Z = np.stack(
-                [
-                    other_item_count,
-                    other_component_count,
-                    other_completed_count,
-                    Z_full[:, 3],
-                    Z_full[:, 4],
-                    Z_full[:, 5],
-                    Z_full[:, 6],
-                ],
-                axis=1,
+                    completed_rows.append(rows)
+
+            # Rest-of-board counts: subtract this unit's items in place. Z_full is a fresh
+            # (n, 7) array, so it becomes Z directly without stacking a copy.
+            n_rows = int(base_ids.size)
+            unit_component_count = np.bincount(
+                np.concatenate(component_rows) if component_rows else np.zeros((0,), dtype=np.intp), minlength=n_rows
+            )
+            unit_completed_count = np.bincount(
+                np.concatenate(completed_rows) if completed_rows else np.zeros((0,), dtype=np.intp), minlength=n_rows
             )
-            X = hstack([X_tok.astype(np.float32), csr_matrix(Z, dtype=np.float32)], format="csr")
+            Z = Z_full
+            Z[:, 0] -= unit_component_count + unit_completed_count
+            Z[:, 1] -= unit_component_count
+            Z[:, 2] -= unit_completed_count
+            np.maximum(Z[:, :3], 0.0, out=Z[:, :3])
+
+            X = append_dense_columns(X_tok, Z)
 
             cfg = AIPWConfig(
                 n_splits=n_splits,
@@ -323,10 +449,10 @@ class GraphEngine:
                     continue
 
                 treated_bm = base_bitmap_model & tok_stats.bitmap
-                treated_ids = np.array(treated_bm.to_array(), dtype=np.int64)
+                treated_ids = np.frombuffer(treated_bm.to_array(), dtype=np.uint32)
                 T = np.zeros((base_ids.size,), dtype=np.int8)
                 if treated_ids.size:
-                    idxs = np.searchsorted(base_ids, treated_ids).astype(np.int64, copy=False)
+                    idxs = np.searchsorted(base_ids, treated_ids)
                     T[idxs] = 1
 
                 n_treated_model = int(T.sum())
@@ -662,6 +788,8 @@ class GraphEngine:
                 count=len(unique_ids)
             )
 
+        self.build_indexes()
+
     @staticmethod
     def _clean_unit_name(name: str) -> str:
         return name.replace("TFT16_", "").replace("TFT_", "")
@@ -696,9 +824,13 @@ class GraphEngine:
         if not bitmaps:
             return BitMap()
 
-        # Roaring intersection is O(min(n,m)) and cache-friendly
+        # Fold smallest-first: every in-place AND is then bounded by the running result,
+        # and an empty intermediate short-circuits the remaining bitmaps.
+        bitmaps.sort(key=len)
         result = bitmaps[0].copy()
         for bm in bitmaps[1:]:
+            if not result:
+                break
             result &= bm
         return result
 
@@ -718,7 +850,7 @@ class GraphEngine:
         if not exclude_tokens:
             return base
 
-        exclude_bm = BitMap()
+        exclude_bms = []
         for tok in exclude_tokens:
             token_id = self.token_to_id.get(tok)
             if token_id is None:
@@ -726,10 +858,11 @@ class GraphEngine:
             stats = self.tokens.get(token_id)
             if stats is None:
                 continue
-            exclude_bm |= stats.bitmap
+            exclude_bms.append(stats.bitmap)
 
-        if exclude_bm:
-            base -= exclude_bm
+        # Subtract each exclude in place rather than materializing their union first.
+        if exclude_bms:
+            base.difference_update(*exclude_bms)
         return base
 
     def avg_placement_for_bitmap(self, bitmap: BitMap) -> float:
@@ -741,9 +874,52 @@ class GraphEngine:
             return 4.5
 
         # Convert bitmap to numpy array and index into placements
-        ids = np.array(bitmap.to_array(), dtype=np.int64)
+        ids = np.frombuffer(bitmap.to_array(), dtype=np.uint32)
         return float(self.placements[ids].mean())
 
+    def token_ids(self, token_strs: list[str]) -> np.ndarray:
+        """Resolve token strings to a dense int64 id array (-1 for unknown tokens)."""
+        get = self.token_to_id.get
+        return np.fromiter((get(t, -1) for t in token_strs), dtype=np.int64, count=len(token_strs))
+
+    def score_candidate_ids(
+        self,
+        base: BitMap,
+        token_ids: np.ndarray,
+        min_sample: int = 10
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Score candidate token ids against `base` (array form of `score_candidates`).
+
+        Returns parallel arrays `(positions, n_with, avg_with)`, where `positions`
+        index into `token_ids` for the candidates that met `min_sample`.
+        """
+        positions: list[int] = []
+        n_withs: list[int] = []
+        avg_withs: list[float] = []
+        if base:
+            tokens = self.tokens
+            for pos, token_id in enumerate(token_ids.tolist()):
+                token_stats = tokens.get(token_id)
+                if token_stats is None:
+                    continue
+
+                # Intersection with base set
+                with_bitmap = base & token_stats.bitmap
+                n_with = len(with_bitmap)
+                if n_with < min_sample:
+                    continue
+
+                positions.append(pos)
+                n_withs.append(n_with)
+                avg_withs.append(self.avg_placement_for_bitmap(with_bitmap))
+
+        return (
+            np.array(positions, dtype=np.int64),
+            np.array(n_withs, dtype=np.int64),
+            np.array(avg_withs, dtype=np.float64),
+        )
+
     def score_candidates(
         self,
         base: BitMap,
@@ -761,35 +937,20 @@ class GraphEngine:
 
         n_base = len(base)
         avg_base = self.avg_placement_for_bitmap(base)
-
-        results = []
-        for token_str in candidates:
-            token_id = self.token_to_id.get(token_str)
-            if token_id is None or token_id not in self.tokens:
-                continue
-
-            token_stats = self.tokens[token_id]
-
-            # Intersection with base set
-            with_bitmap = base & token_stats.bitmap
-            n_with = len(with_bitmap)
-
-            if n_with < min_sample:
-                continue
-
-            avg_with = self.avg_placement_for_bitmap(with_bitmap)
-            delta = avg_with - avg_base
-
-            results.append({
-                "token": token_str,
-                "delta": round(delta, 3),
-                "avg_with": round(avg_with, 3),
+        positions, n_with, avg_with = self.score_candidate_ids(base, self.token_ids(candidates), min_sample)
+        delta = avg_with - avg_base
+
+        return [
+            {
+                "token": candidates[pos],
+                "delta": round(d, 3),
+                "avg_with": round(a, 3),
                 "avg_base": round(avg_base, 3),
-                "n_with": n_with,
+                "n_with": n,
                 "n_base": n_base
-            })
-
-        return results
+            }
+            for pos, n, a, d in zip(positions.tolist(), n_with.tolist(), avg_with.tolist(), delta.tolist())
+        ]
 
     def get_all_tokens_by_type(self, prefix: str) -> list[str]:
         """Get all tokens starting with prefix (U:, I:, E:)."""
@@ -809,6 +970,16 @@ class GraphEngine:
             return token_str
         return self.labels.get(token_id, token_str)
 
+    def get_labels(self, token_strs: list[str]) -> list[str]:
+        """Get display labels for many tokens at once (bulk `get_label`)."""
+        token_to_id = self.token_to_id
+        labels = self.labels
+        out: list[str] = []
+        for token_str in token_strs:
+            token_id = token_to_id.get(token_str)
+            out.append(token_str if token_id is None else labels.get(token_id, token_str))
+        return out
+
     def apply_item_display_names(self, item_display_names: dict[str, str]) -> int:
         """
         Update labels for item (I:*) and equipped (E:*) tokens using a mapping of
@@ -993,6 +1164,7 @@ class GraphEngine:
             f.write(_arr_or_zeros(self.unit_gold_value, np.int32).tobytes())
 
             # All players bitmap
+            self.all_players.run_optimize()
             all_players_bytes = self.all_players.serialize()
             f.write(struct.pack("<I", len(all_players_bytes)))
             f.write(all_players_bytes)
@@ -1011,9 +1183,14 @@ class GraphEngine:
                 f.write(label_bytes)
 
             # Token stats (bitmap + sum + count)
+            # Convert dense id ranges to run containers before serializing: popular tokens
+            # cover long runs of consecutive player ids, which shrinks the file (and the
+            # in-memory bitmaps) and speeds up later AND/ANDNOT.
             for token_id in range(len(self.id_to_token)):
                 if token_id in self.tokens:
                     stats = self.tokens[token_id]
+                    stats.bitmap.run_optimize()
+                    stats.bitmap.shrink_to_fit()
                     bitmap_bytes = stats.bitmap.serialize()
                     f.write(struct.pack("<I", len(bitmap_bytes)))
                     f.write(bitmap_bytes)
@@ -1127,20 +1304,17 @@ class GraphEngine:
 
             # Precomputed necessity cache (Version 3).
             n = int(num_tokens)
-            engine.necessity_top4_tau = np.frombuffer(f.read(n * 4), dtype=np.float32).copy()
-            engine.necessity_top4_ci95_low = np.frombuffer(f.read(n * 4), dtype=np.float32).copy()
-            engine.necessity_top4_ci95_high = np.frombuffer(f.read(n * 4), dtype=np.float32).copy()
-            engine.necessity_top4_se = np.frombuffer(f.read(n * 4), dtype=np.float32).copy()
-            engine.necessity_top4_raw_tau = np.frombuffer(f.read(n * 4), dtype=np.float32).copy()
-            engine.necessity_top4_frac_trimmed = np.frombuffer(f.read(n * 4), dtype=np.float32).copy()
-            engine.necessity_top4_e_p01 = np.frombuffer(f.read(n * 4), dtype=np.float32).copy()
-            engine.necessity_top4_e_p99 = np.frombuffer(f.read(n * 4), dtype=np.float32).copy()
-            engine.necessity_top4_n_treated = np.frombuffer(f.read(n * 4), dtype=np.int32).copy()
-            engine.necessity_top4_n_control = np.frombuffer(f.read(n * 4), dtype=np.int32).copy()
-            engine.necessity_top4_n_used = np.frombuffer(f.read(n * 4), dtype=np.int32).copy()
-            engine.necessity_top4_scope_min_star = np.frombuffer(f.read(n), dtype=np.uint8).copy()
+            # Fields are stored column by column in NECESSITY_TOP4_STATS_DTYPE order.
+            stats = np.empty((n,), dtype=NECESSITY_TOP4_STATS_DTYPE)
+            for name in NECESSITY_TOP4_STATS_DTYPE.names:
+                field_dtype = NECESSITY_TOP4_STATS_DTYPE[name]
+                stats[name] = np.frombuffer(f.read(n * field_dtype.itemsize), dtype=field_dtype)
+            engine.necessity_top4_stats = stats
+            engine.bind_necessity_fields_top4()
             engine.necessity_top4_ready = bool(np.isfinite(engine.necessity_top4_tau).any())
 
+        engine.build_indexes()
+
         print(f"Loaded engine: {num_tokens} tokens, {total_matches} matches")
         return engine
 
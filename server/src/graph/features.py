@@ -117,11 +117,10 @@ def build_sparse_feature_matrix(
         if token_stats is None:
             continue
 
-        ids_list = (base & token_stats.bitmap).to_array()
-        if not ids_list:
+        ids = np.frombuffer((base & token_stats.bitmap).to_array(), dtype=np.uint32)
+        if not ids.size:
             continue
 
-        ids = np.array(ids_list, dtype=np.int64)
         rows = np.searchsorted(base_ids, ids).astype(np.int32, copy=False)
 
         kept_features.append(token)
@@ -148,27 +147,78 @@ def board_strength_features(engine: GraphEngine, ids: np.ndarray) -> np.ndarray:
     """
     Return numeric "board strength proxy" features aligned to `ids`.
 
-    Shape: (n_rows, 7)
+    Shape: (n_rows, 7), float32 (callers use it as-is in the design matrix).
     """
     n = int(ids.size)
-    if n == 0:
-        return np.zeros((0, 7), dtype=np.float32)
-
-    def take(arr: np.ndarray | None, dtype: np.dtype) -> np.ndarray:
-        if arr is None:
-            return np.zeros((n,), dtype=dtype)
-        return arr[ids].astype(dtype, copy=False)
-
-    return np.stack(
-        [
-            take(engine.item_count, np.float32),
-            take(engine.component_count, np.float32),
-            take(engine.completed_item_count, np.float32),
-            take(engine.unit_count, np.float32),
-            take(engine.two_star_count, np.float32),
-            take(engine.three_star_count, np.float32),
-            take(engine.unit_gold_value, np.float32),
-        ],
-        axis=1,
+    columns = (
+        engine.item_count,
+        engine.component_count,
+        engine.completed_item_count,
+        engine.unit_count,
+        engine.two_star_count,
+        engine.three_star_count,
+        engine.unit_gold_value,
     )
+    out = np.zeros((n, len(columns)), dtype=np.float32)
+    if n == 0:
+        return out
+    for j, arr in enumerate(columns):
+        if arr is not None:
+            # Gather and cast straight into the output column.
+            out[:, j] = arr[ids]
+    return out
+
+
+def append_dense_columns(X: "csr_matrix", Z: np.ndarray) -> "csr_matrix":
+    """
+    Return float32 CSR `[X | Z]` for sparse X (n, p) and dense Z (n, q).
+
+    Equivalent to `hstack([X.astype(float32), csr_matrix(Z)], format="csr")` (each row
+    keeps X's entries followed by Z's nonzeros), but assembled in one pass without
+    converting Z to CSR or re-stacking the blocks.
+    """
+    from scipy.sparse import csr_matrix
+
+    n_rows, p = X.shape
+    q = int(Z.shape[1])
+    x_counts = np.diff(X.indptr)
+    z_rows, z_cols = np.nonzero(Z)
+    z_counts = np.bincount(z_rows, minlength=n_rows)
 
+    indptr = np.zeros((n_rows + 1,), dtype=np.int64)
+    np.cumsum(x_counts + z_counts, out=indptr[1:])
+    nnz = int(indptr[-1])
+    data = np.empty((nnz,), dtype=np.float32)
+    indices = np.empty((nnz,), dtype=np.int32)
+
+    # X entries keep their in-row order at the start of each output row.
+    x_rows = np.repeat(np.arange(n_rows), x_counts)
+    x_dest = indptr[x_rows] + (np.arange(X.nnz) - X.indptr[x_rows])
+    data[x_dest] = X.data
+    indices[x_dest] = X.indices
+
+    # Z nonzeros follow, in column order (np.nonzero is row-major).
+    z_start = np.zeros((n_rows,), dtype=np.int64)
+    np.cumsum(z_counts[:-1], out=z_start[1:])
+    z_dest = indptr[z_rows] + x_counts[z_rows] + (np.arange(z_rows.size) - z_start[z_rows])
+    data[z_dest] = Z[z_rows, z_cols]
+    indices[z_dest] = p + z_cols
+
+    return csr_matrix((data, indices, indptr), shape=(n_rows, p + q))
+
+
+def feature_cluster_counts(X: "csr_matrix", labels: np.ndarray, n_clusters: int) -> np.ndarray:
+    """
+    Return int32 counts (n_clusters, n_features) of rows with each feature present, per cluster.
+
+    Equivalent to `np.bincount(labels[rows], minlength=n_clusters)` for every feature column,
+    but done as a single bincount over X's nonzeros keyed by (cluster, feature).
+    """
+    n_rows, n_features = X.shape
+    if n_features == 0 or X.nnz == 0:
+        return np.zeros((n_clusters, n_features), dtype=np.int32)
+
+    row_labels = np.repeat(labels.astype(np.int64, copy=False), np.diff(X.indptr))
+    keys = row_labels * n_features + X.indices
+    counts = np.bincount(keys, minlength=n_clusters * n_features)
+    return counts.reshape(n_clusters, n_features).astype(np.int32, copy=False)
@@ -4,22 +4,38 @@ Query server for the optimized graph engine.
 Uses the high-performance GraphEngine with roaring bitmaps
 for sub-millisecond query response times at scale.
 """
-import json
+import asyncio
+import hashlib
+import heapq
 import os
+import re
+import sys
 import threading
 import time
-from collections import deque
-from contextlib import asynccontextmanager
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from contextlib import asynccontextmanager, nullcontext
+from dataclasses import dataclass
+from functools import lru_cache
+from itertools import filterfalse, repeat
 from pathlib import Path
+from types import MappingProxyType
+from typing import Any, Mapping
 
+import anyio
 import numpy as np
+import orjson
 from dotenv import load_dotenv
+from pyroaring import BitMap, FrozenBitMap
+from scipy.sparse import csr_matrix
+from sklearn.cluster import MiniBatchKMeans
 load_dotenv()  # Load .env file
 
 from fastapi import FastAPI, Query, UploadFile, File, Header, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
 import uvicorn
 import httpx
 
@@ -33,7 +49,14 @@ from .clustering import (
     compute_token_stats,
 )
 from .causal import AIPWConfig, OverlapError, aipw_ate, e_value_from_risk_ratio, placements_to_outcome
-from .features import TokenFeatureParams, board_strength_features, build_sparse_feature_matrix, select_feature_tokens
+from .features import (
+    TokenFeatureParams,
+    append_dense_columns,
+    board_strength_features,
+    build_sparse_feature_matrix,
+    feature_cluster_counts,
+    select_feature_tokens,
+)
 from .items import get_item_prefix, get_item_type
 
 # OpenAI API key for voice transcription and parsing
@@ -75,13 +98,23 @@ VOICE_MAX_SESSIONS_PER_IP_PER_MINUTE = _env_int("VOICE_MAX_SESSIONS_PER_IP_PER_M
 VOICE_MAX_SESSIONS_PER_IP_PER_HOUR = _env_int("VOICE_MAX_SESSIONS_PER_IP_PER_HOUR", 120, min_value=1, max_value=100_000)
 VOICE_MAX_SESSIONS_GLOBAL_PER_MINUTE = _env_int("VOICE_MAX_SESSIONS_GLOBAL_PER_MINUTE", 120, min_value=1, max_value=100_000)
 VOICE_MAX_CONCURRENT_SESSION_CREATIONS = _env_int("VOICE_MAX_CONCURRENT_SESSION_CREATIONS", 4, min_value=1, max_value=1000)
+VOICE_STATE_MAX_IPS = _env_int("VOICE_STATE_MAX_IPS", 100_000, min_value=100, max_value=10_000_000)
 
 _voice_lock = threading.Lock()
-_voice_ip_state: dict[str, dict] = {}
+# Fixed-window counters: (ip, minute bucket) / (ip, hour bucket) -> attempts. Stale
+# buckets are swept whenever a new global minute bucket starts, and each map is also
+# capped at VOICE_STATE_MAX_IPS entries (oldest evicted first) so a flood of distinct
+# client IPs inside one window can't grow memory without bound.
+_voice_ip_last: OrderedDict[str, float] = OrderedDict()
+_voice_ip_minute_counts: OrderedDict[tuple[str, int], int] = OrderedDict()
+_voice_ip_hour_counts: OrderedDict[tuple[str, int], int] = OrderedDict()
 _voice_global_state = {
-    "minute": deque(),
-    "concurrent": 0,
+    "minute_bucket": -1,
+    "minute_count": 0,
 }
+# In-flight session creations (basic concurrency guard against thundering herds /
+# runaway retries). Binds to the running loop on first use.
+_voice_semaphore = asyncio.Semaphore(VOICE_MAX_CONCURRENT_SESSION_CREATIONS)
 
 
 def _get_client_ip(request: Request) -> str:
@@ -93,10 +126,15 @@ def _get_client_ip(request: Request) -> str:
     return request.client.host if request.client else "unknown"
 
 
-def _prune_times(q: deque, now: float, window_s: float) -> None:
-    cutoff = now - window_s
-    while q and q[0] < cutoff:
-        q.popleft()
+def _sweep_voice_windows(now: float, minute: int, hour: int) -> None:
+    """Drop counters from finished windows and expired cooldowns (call under _voice_lock)."""
+    for key in [k for k in _voice_ip_minute_counts if k[1] < minute]:
+        del _voice_ip_minute_counts[key]
+    for key in [k for k in _voice_ip_hour_counts if k[1] < hour]:
+        del _voice_ip_hour_counts[key]
+    cutoff = now - VOICE_MIN_SECONDS_BETWEEN_SESSIONS
+    for ip in [ip for ip, last in _voice_ip_last.items() if last < cutoff]:
+        del _voice_ip_last[ip]
 
 
 def _enforce_voice_rate_limits(request: Request) -> None:
@@ -105,19 +143,17 @@ def _enforce_voice_rate_limits(request: Request) -> None:
 
     now = time.time()
     ip = _get_client_ip(request)
+    minute = int(now // 60)
+    hour = int(now // 3600)
 
     with _voice_lock:
-        st = _voice_ip_state.get(ip)
-        if st is None:
-            st = {"last": 0.0, "minute": deque(), "hour": deque()}
-            _voice_ip_state[ip] = st
-
-        _prune_times(st["minute"], now, 60.0)
-        _prune_times(st["hour"], now, 3600.0)
-        _prune_times(_voice_global_state["minute"], now, 60.0)
+        if _voice_global_state["minute_bucket"] != minute:
+            _voice_global_state["minute_bucket"] = minute
+            _voice_global_state["minute_count"] = 0
+            _sweep_voice_windows(now, minute, hour)
 
         # Basic concurrency guard (prevents thundering herds / runaway retries).
-        if _voice_global_state["concurrent"] >= VOICE_MAX_CONCURRENT_SESSION_CREATIONS:
+        if _voice_semaphore.locked():
             raise HTTPException(
                 status_code=429,
                 detail="Voice is busy right now. Try again in a few seconds.",
@@ -125,7 +161,7 @@ def _enforce_voice_rate_limits(request: Request) -> None:
             )
 
         # Per-IP cooldown
-        last = float(st.get("last") or 0.0)
+        last = _voice_ip_last.get(ip, 0.0)
         if VOICE_MIN_SECONDS_BETWEEN_SESSIONS > 0 and last > 0:
             since = now - last
             if since < VOICE_MIN_SECONDS_BETWEEN_SESSIONS:
@@ -136,51 +172,39 @@ def _enforce_voice_rate_limits(request: Request) -> None:
                     headers={"Retry-After": str(retry)},
                 )
 
-        # Per-IP minute/hour limits
-        if len(st["minute"]) >= VOICE_MAX_SESSIONS_PER_IP_PER_MINUTE:
-            retry = 30
-            if st["minute"]:
-                retry = max(1, int(60 - (now - st["minute"][0])) + 1)
+        # Per-IP minute/hour limits (retry once the current window ends)
+        minute_key = (ip, minute)
+        hour_key = (ip, hour)
+        if _voice_ip_minute_counts.get(minute_key, 0) >= VOICE_MAX_SESSIONS_PER_IP_PER_MINUTE:
             raise HTTPException(
                 status_code=429,
                 detail="Voice rate limit exceeded. Try again soon.",
-                headers={"Retry-After": str(retry)},
+                headers={"Retry-After": str(max(1, int((minute + 1) * 60 - now) + 1))},
             )
-        if len(st["hour"]) >= VOICE_MAX_SESSIONS_PER_IP_PER_HOUR:
-            retry = 300
-            if st["hour"]:
-                retry = max(1, int(3600 - (now - st["hour"][0])) + 1)
+        if _voice_ip_hour_counts.get(hour_key, 0) >= VOICE_MAX_SESSIONS_PER_IP_PER_HOUR:
             raise HTTPException(
                 status_code=429,
                 detail="Voice hourly limit exceeded. Try again later.",
-                headers={"Retry-After": str(retry)},
+                headers={"Retry-After": str(max(1, int((hour + 1) * 3600 - now) + 1))},
             )
 
         # Global minute limit (helps protect against broad abuse).
-        if len(_voice_global_state["minute"]) >= VOICE_MAX_SESSIONS_GLOBAL_PER_MINUTE:
-            retry = 5
-            if _voice_global_state["minute"]:
-                retry = max(1, int(60 - (now - _voice_global_state["minute"][0])) + 1)
+        if _voice_global_state["minute_count"] >= VOICE_MAX_SESSIONS_GLOBAL_PER_MINUTE:
             raise HTTPException(
                 status_code=429,
                 detail="Voice is temporarily rate-limited. Try again shortly.",
-                headers={"Retry-After": str(retry)},
+                headers={"Retry-After": str(max(1, int((minute + 1) * 60 - now) + 1))},
             )
 
-        # Record the attempt + reserve a concurrency slot.
-        st["last"] = now
-        st["minute"].append(now)
-        st["hour"].append(now)
-        _voice_global_state["minute"].append(now)
-        _voice_global_state["concurrent"] += 1
-
-
-def _release_voice_concurrency_slot() -> None:
-    if not VOICE_RATE_LIMIT_ENABLED:
-        return
-    with _voice_lock:
-        if _voice_global_state["concurrent"] > 0:
-            _voice_global_state["concurrent"] -= 1
+        # Record the attempt (the caller then takes a _voice_semaphore slot).
+        _voice_ip_last[ip] = now
+        _voice_ip_last.move_to_end(ip, last=True)
+        _voice_ip_minute_counts[minute_key] = _voice_ip_minute_counts.get(minute_key, 0) + 1
+        _voice_ip_hour_counts[hour_key] = _voice_ip_hour_counts.get(hour_key, 0) + 1
+        for state in (_voice_ip_last, _voice_ip_minute_counts, _voice_ip_hour_counts):
+            while len(state) > VOICE_STATE_MAX_IPS:
+                state.popitem(last=False)
+        _voice_global_state["minute_count"] += 1
 
 
 ENGINE: GraphEngine = None
@@ -188,7 +212,6 @@ ENGINE: GraphEngine = None
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    import os
     global ENGINE
     data_dir = Path(os.environ.get("DATA_DIR", "../data"))
     engine_path = data_dir / "engine.bin"
@@ -198,7 +221,7 @@ async def lifespan(app: FastAPI):
         try:
             ENGINE = GraphEngine.load(str(engine_path))
             stats = ENGINE.stats()
-            print(f"Engine ready: {stats['total_tokens']} tokens, {stats['total_matches']} matches")
+            print(f"Engine ready: {stats['total_tokens']} tokens, {stats['total_matches']} matches ({engine_path.stat().st_size / 1e6:.1f} MB on disk)")
 
             # Upgrade old engines (built before equipped-count tokens) so duplicate-item
             # filters/builds work without requiring manual rebuild steps.
@@ -226,27 +249,17 @@ async def lifespan(app: FastAPI):
 
                     # Preserve cached top4 necessity estimates from the previous engine for any
                     # shared tokens. New duplicate-count tokens will remain uncached (NaN).
-                    if getattr(old_engine, "necessity_top4_tau", None) is not None:
+                    if getattr(old_engine, "necessity_top4_stats", None) is not None:
                         try:
                             ENGINE.init_necessity_cache_top4()
-                            for tok in old_engine.id_to_token:
-                                old_id = old_engine.token_to_id.get(tok)
-                                new_id = ENGINE.token_to_id.get(tok)
-                                if old_id is None or new_id is None:
-                                    continue
-
-                                ENGINE.necessity_top4_tau[new_id] = old_engine.necessity_top4_tau[old_id]
-                                ENGINE.necessity_top4_ci95_low[new_id] = old_engine.necessity_top4_ci95_low[old_id]
-                                ENGINE.necessity_top4_ci95_high[new_id] = old_engine.necessity_top4_ci95_high[old_id]
-                                ENGINE.necessity_top4_se[new_id] = old_engine.necessity_top4_se[old_id]
-                                ENGINE.necessity_top4_raw_tau[new_id] = old_engine.necessity_top4_raw_tau[old_id]
-                                ENGINE.necessity_top4_frac_trimmed[new_id] = old_engine.necessity_top4_frac_trimmed[old_id]
-                                ENGINE.necessity_top4_e_p01[new_id] = old_engine.necessity_top4_e_p01[old_id]
-                                ENGINE.necessity_top4_e_p99[new_id] = old_engine.necessity_top4_e_p99[old_id]
-                                ENGINE.necessity_top4_n_treated[new_id] = old_engine.necessity_top4_n_treated[old_id]
-                                ENGINE.necessity_top4_n_control[new_id] = old_engine.necessity_top4_n_control[old_id]
-                                ENGINE.necessity_top4_n_used[new_id] = old_engine.necessity_top4_n_used[old_id]
-                                ENGINE.necessity_top4_scope_min_star[new_id] = old_engine.necessity_top4_scope_min_star[old_id]
+                            shared = [
+                                (old_id, new_id)
+                                for old_id, tok in enumerate(old_engine.id_to_token)
+                                if (new_id := ENGINE.token_to_id.get(tok)) is not None
+                            ]
+                            if shared:
+                                old_ids, new_ids = (np.array(ids, dtype=np.int64) for ids in zip(*shared))
+                                ENGINE.necessity_top4_stats[new_ids] = old_engine.necessity_top4_stats[old_ids]
 
                             ENGINE.necessity_top4_ready = bool(np.isfinite(ENGINE.necessity_top4_tau).any())
                         except Exception as e:
@@ -274,10 +287,30 @@ async def lifespan(app: FastAPI):
         print("Upload smeecher.db via POST /upload-data, then restart the service.")
         ENGINE = None
 
-    yield
+    _reset_engine_caches()
+    if ENGINE is not None:
+        _warm_engine_caches()
 
+    # One pooled client for outbound API calls, so keep-alive connections (and their
+    # TLS sessions) are reused across requests instead of re-handshaking every time.
+    app.state.http_client = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        timeout=10.0,
+    )
+    try:
+        yield
+    finally:
+        await app.state.http_client.aclose()
+
+
+class OrjsonResponse(JSONResponse):
+    """JSONResponse rendered with orjson (numpy scalars/arrays serialize natively)."""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
 
-app = FastAPI(lifespan=lifespan)
+
+app = FastAPI(lifespan=lifespan, default_response_class=OrjsonResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -301,6 +334,24 @@ print(f"{'='*60}\n")
 
 from fastapi import Request
 
+_UPLOAD_FLUSH_BYTES = 4 * 1024 * 1024
+
+
+def _drop_upload_page_cache(f) -> None:
+    """
+    Persist an uploaded file and hint the kernel to evict its pages.
+
+    Uploads are one-shot (the file is only read back on the next restart), so keeping
+    hundreds of MB in page cache just crowds out the live process. Dirty pages can't be
+    dropped, hence the fdatasync before POSIX_FADV_DONTNEED.
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+    f.flush()
+    fd = f.fileno()
+    os.fdatasync(fd)
+    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+
 @app.put("/upload-data/{filename}")
 async def upload_data(
     filename: str,
@@ -311,7 +362,8 @@ async def upload_data(
     Upload database or engine file to the data volume.
     DELETE THIS ENDPOINT AFTER USE.
     """
-    if x_upload_secret != UPLOAD_SECRET:
+    # Constant-time compare; bytes so non-ASCII header values can't raise TypeError.
+    if not secrets.compare_digest(x_upload_secret.encode("utf-8"), UPLOAD_SECRET.encode("utf-8")):
         raise HTTPException(status_code=403, detail="Invalid secret")
 
     if filename not in ("smeecher.db", "engine.bin"):
@@ -322,12 +374,25 @@ async def upload_data(
 
     dest = data_dir / filename
 
-    # Stream to file to handle large uploads
-    with open(dest, "wb") as f:
+    # Stream to file to handle large uploads. Chunks are batched into ~4 MiB buffers and
+    # written from a worker thread so disk I/O never blocks the event loop.
+    # The buffer is only mutated after each awaited write returns, so it's written
+    # without an intermediate bytes() copy.
+    f = await anyio.to_thread.run_sync(open, dest, "wb")
+    try:
+        buf = bytearray()
         async for chunk in request.stream():
-            f.write(chunk)
+            buf += chunk
+            if len(buf) >= _UPLOAD_FLUSH_BYTES:
+                await anyio.to_thread.run_sync(f.write, buf)
+                buf.clear()
+        if buf:
+            await anyio.to_thread.run_sync(f.write, buf)
+        await anyio.to_thread.run_sync(_drop_upload_page_cache, f)
+    finally:
+        await anyio.to_thread.run_sync(f.close)
 
-    size_mb = dest.stat().st_size / 1024 / 1024
+    size_mb = (await anyio.to_thread.run_sync(dest.stat)).st_size / 1024 / 1024
     return {"status": "ok", "file": filename, "size_mb": size_mb}
 # ─────────────────────────────────────────────────────────────────
 
@@ -396,8 +461,238 @@ def _parse_item_prefixes_param(item_prefixes: str) -> set[str]:
     return normalized
 
 
-def parse_token(token: str) -> dict:
-    """Parse token into components."""
+# Filtered base sets are shared across endpoints: the graph, unit-build, unit-items,
+# item-units and item-necessity panels typically re-request the same filter context.
+_BASE_BITMAP_LOCK = threading.Lock()
+_BASE_BITMAP_CACHE: OrderedDict[tuple, tuple[float, FrozenBitMap, int, float]] = OrderedDict()
+_BASE_BITMAP_CACHE_MAX = 128
+_BASE_BITMAP_CACHE_TTL_S = 10 * 60
+
+# Full /item-necessity responses: the AIPW fit is deterministic for a given engine and
+# query, and the UI re-requests the same (unit, item, filters) while browsing.
+_ITEM_NECESSITY_LOCK = threading.Lock()
+_ITEM_NECESSITY_CACHE: OrderedDict[tuple, tuple[float, dict]] = OrderedDict()
+_ITEM_NECESSITY_CACHE_MAX = 256
+_ITEM_NECESSITY_CACHE_TTL_S = 10 * 60
+
+# Token-presence design matrices for /item-necessity: every item on a unit shares the
+# same base rows (unless subsampled) and the same unit/trait feature tokens.
+_TOKEN_MATRIX_LOCK = threading.Lock()
+_TOKEN_MATRIX_CACHE: OrderedDict[tuple, tuple[float, csr_matrix, list[str], np.ndarray]] = OrderedDict()
+_TOKEN_MATRIX_CACHE_MAX = 64
+_TOKEN_MATRIX_CACHE_TTL_S = 10 * 60
+
+
+def _filter_equipped_ids(ids: BitMap, allowed_item_types: set[str] | None, allowed_item_prefixes: set[str]) -> BitMap:
+    """
+    Narrow a set of equipped token ids using the engine's item type/prefix id sets.
+
+    Same semantics as the per-item checks: item types must be allowed (when given), and
+    prefixed set items are only kept when their prefix is selected.
+    """
+    if allowed_item_types is not None:
+        by_type = ENGINE.equipped_ids_by_type
+        ids = ids & BitMap.union(*[by_type.get(t) or BitMap() for t in allowed_item_types])
+    for prefix, prefix_ids in ENGINE.equipped_ids_by_prefix.items():
+        if prefix not in allowed_item_prefixes:
+            ids = ids - prefix_ids
+    return ids
+
+
+_NECESSITY_FLOAT_FIELDS = ("tau", "ci95_low", "ci95_high", "se", "raw_tau", "frac_trimmed", "e_p01", "e_p99")
+
+
+def _cached_necessity_rows(token_ids: list[int], outcome: str, scope_min_star: int | None = None) -> list[dict | None]:
+    """
+    Build cached AIPW necessity payloads for many E: token ids at once.
+
+    Fields are gathered from the packed top4 cache in one fancy-index, and finiteness and
+    warning flags are evaluated as array masks. With `scope_min_star`, entries computed
+    under a different star scope are dropped; otherwise the stored scope (default 1) is
+    reported. Returns None where no usable estimate exists.
+    """
+    stats = ENGINE.necessity_top4_stats[np.asarray(token_ids, dtype=np.int64)]
+    finite = {name: np.isfinite(stats[name]) for name in _NECESSITY_FLOAT_FIELDS}
+    rounded = {
+        name: [round(v, 6) if ok else None for v, ok in zip(stats[name].tolist(), finite[name].tolist())]
+        for name in _NECESSITY_FLOAT_FIELDS
+    }
+
+    stored_scope = stats["scope_min_star"]
+    keep = finite["tau"]
+    if scope_min_star is not None:
+        keep = keep & ((stored_scope == 0) | (stored_scope == scope_min_star))
+    low_overlap = (finite["frac_trimmed"] & (stats["frac_trimmed"] > 0.5)).tolist()
+    positivity = (
+        finite["e_p01"] & finite["e_p99"] & ((stats["e_p01"] < 0.02) | (stats["e_p99"] > 0.98))
+    ).tolist()
+    default_scope = scope_min_star if scope_min_star is not None else 1
+
+    n_treated = stats["n_treated"].tolist()
+    n_control = stats["n_control"].tolist()
+    n_used = stats["n_used"].tolist()
+    scopes = stored_scope.tolist()
+
+    out: list[dict | None] = []
+    for i, ok in enumerate(keep.tolist()):
+        if not ok:
+            out.append(None)
+            continue
+        warnings: list[str] = []
+        if low_overlap[i]:
+            warnings.append("Low overlap: large fraction of samples trimmed by propensity bounds.")
+        if positivity[i]:
+            warnings.append("Positivity warning: propensity is near 0/1 in parts of X (effect may be unstable).")
+        out.append(
+            {
+                "method": "aipw",
+                "outcome": outcome,
+                "tau": rounded["tau"][i],
+                "ci95_low": rounded["ci95_low"][i],
+                "ci95_high": rounded["ci95_high"][i],
+                "se": rounded["se"][i],
+                "p_value": None,
+                "raw_tau": rounded["raw_tau"][i],
+                "n_treated": n_treated[i],
+                "n_control": n_control[i],
+                "n_used": n_used[i],
+                "frac_trimmed": rounded["frac_trimmed"][i],
+                "e_p01": rounded["e_p01"][i],
+                "e_p50": None,
+                "e_p99": rounded["e_p99"][i],
+                "risk_ratio": None,
+                "e_value": None,
+                "warnings": warnings,
+                "cached": True,
+                "scope_min_star": scopes[i] or default_scope,
+            }
+        )
+    return out
+
+
+# Rounded /item-necessity fast-path payloads per E: token id, built once per ENGINE:
+# token id -> (effect, overlap, warnings, stored scope_min_star).
+_necessity_top4_payloads: dict[int, tuple[dict, dict, tuple[str, ...], int]] | None = None
+
+
+def _necessity_top4_payload(token_id: int) -> tuple[dict, dict, tuple[str, ...], int] | None:
+    """Return the precomputed cached-top4 payload for `token_id` (None when uncached)."""
+    global _necessity_top4_payloads
+    payloads = _necessity_top4_payloads
+    if payloads is None:
+        payloads = {}
+        stats = getattr(ENGINE, "necessity_top4_stats", None)
+        if stats is not None:
+            ids = np.flatnonzero(np.isfinite(stats["tau"]) & (stats["scope_min_star"] != 0)).tolist()
+            for tok_id, row in zip(ids, _cached_necessity_rows(ids, "top4")):
+                if row is None:
+                    continue
+                effect = {
+                    "method": "aipw",
+                    "outcome": "top4",
+                    "kind": "binary",
+                    "tau": row["tau"],
+                    "ci95_low": row["ci95_low"],
+                    "ci95_high": row["ci95_high"],
+                    "se": row["se"],
+                    "p_value": None,
+                    "raw_tau": row["raw_tau"],
+                    "y1": None,
+                    "y0": None,
+                }
+                overlap = {
+                    "n_used": row["n_used"],
+                    "frac_trimmed": row["frac_trimmed"],
+                    "e_min": None,
+                    "e_p01": row["e_p01"],
+                    "e_p50": None,
+                    "e_p99": row["e_p99"],
+                    "e_max": None,
+                }
+                payloads[tok_id] = (effect, overlap, tuple(row["warnings"]), row["scope_min_star"])
+        _necessity_top4_payloads = payloads
+    return payloads.get(token_id)
+
+
+def _filter_bitmap_cached(include_tokens: list[str], exclude_tokens: list[str]) -> tuple[FrozenBitMap, int, float]:
+    """
+    Cached ENGINE.filter_bitmap() returning (bitmap, n, avg_placement).
+
+    The bitmap is frozen because it is shared between requests; in-place operators
+    like `&=` rebind to a new bitmap instead of mutating the cached one.
+    """
+    key = (tuple(sorted(include_tokens)), tuple(sorted(exclude_tokens)))
+    now = time.time()
+    with _BASE_BITMAP_LOCK:
+        entry = _BASE_BITMAP_CACHE.get(key)
+        if entry is not None:
+            ts, bitmap, n, avg = entry
+            if (now - ts) <= _BASE_BITMAP_CACHE_TTL_S:
+                _BASE_BITMAP_CACHE.move_to_end(key, last=True)
+                return bitmap, n, avg
+            _BASE_BITMAP_CACHE.pop(key, None)
+
+    bitmap = FrozenBitMap(ENGINE.filter_bitmap(list(include_tokens), list(exclude_tokens)))
+    n = len(bitmap)
+    avg = ENGINE.avg_placement_for_bitmap(bitmap)
+
+    with _BASE_BITMAP_LOCK:
+        _BASE_BITMAP_CACHE[key] = (now, bitmap, n, avg)
+        _BASE_BITMAP_CACHE.move_to_end(key, last=True)
+        while len(_BASE_BITMAP_CACHE) > _BASE_BITMAP_CACHE_MAX:
+            _BASE_BITMAP_CACHE.popitem(last=False)
+    return bitmap, n, avg
+
+
+def _reset_engine_caches() -> None:
+    """Drop request caches derived from ENGINE (call whenever ENGINE is replaced)."""
+    global _voice_vocab_cache, _tool_definition_cache, _voice_vocab_json_cache, _necessity_top4_payloads
+    global _session_update_json_cache, _item_filters_cache
+    global _search_index_cache, _search_trigram_cache, _search_index_body
+    global _graph_tokens_cache
+    with _BASE_BITMAP_LOCK:
+        _BASE_BITMAP_CACHE.clear()
+    with _ITEM_NECESSITY_LOCK:
+        _ITEM_NECESSITY_CACHE.clear()
+    with _TOKEN_MATRIX_LOCK:
+        _TOKEN_MATRIX_CACHE.clear()
+    _voice_vocab_cache = None
+    _tool_definition_cache = None
+    _voice_vocab_json_cache = None
+    _session_update_json_cache = None
+    _item_filters_cache = None
+    _search_index_cache = None
+    _search_trigram_cache = None
+    _search_index_body = None
+    _necessity_top4_payloads = None
+    _graph_tokens_cache = None
+    _equipped_ids_by_item_prefix.clear()
+    _graph_root_body.cache_clear()
+
+
+def _warm_engine_caches() -> None:
+    """
+    Build the static per-engine payloads up front so first page loads are hot: the
+    root /graph body, item filters, search index (+ trigram index) and voice vocab.
+    """
+    _graph_root_body(None, frozenset())
+    _get_item_filters()
+    _get_search_trigram_index()
+    _get_voice_vocab()
+
+
+@lru_cache(maxsize=65536)
+def parse_token(token: str) -> Mapping[str, Any]:
+    """
+    Parse token into components.
+
+    Memoized: tokens come from a small universe and repeat across requests, so the
+    parsed mapping is shared and read-only.
+    """
+    return MappingProxyType(_parse_token(token))
+
+
+def _parse_token(token: str) -> dict:
     raw = token.lstrip("-!")
     negated = raw != token
     token = raw
@@ -442,40 +737,82 @@ def parse_token(token: str) -> dict:
     return {"type": "unknown", "negated": negated}
 
 
-def get_center_info(tokens: list[str]) -> dict:
-    """Determine center type from tokens."""
+def get_center_info(tokens: list[str], parsed_tokens: list[Mapping[str, Any]] | None = None) -> dict:
+    """Determine center type from tokens (pass `parsed_tokens` to reuse existing parses)."""
     if not tokens:
         return {"type": "empty", "units": [], "items": [], "traits": []}
+    if parsed_tokens is None:
+        parsed_tokens = [parse_token(t) for t in tokens]
 
-    units = []
-    items = []
+    units: set[str] = set()
+    items: set[str] = set()
     equipped = []
-    traits = []
+    traits: set[str] = set()
 
-    for t in tokens:
-        parsed = parse_token(t)
+    for parsed in parsed_tokens:
         if parsed.get("negated"):
             continue
-        if parsed["type"] == "unit":
-            units.append(parsed["unit"])
-        elif parsed["type"] == "item":
-            items.append(parsed["item"])
-        elif parsed["type"] == "equipped":
-            units.append(parsed["unit"])
-            items.append(parsed["item"])
+        token_type = parsed["type"]
+        if token_type == "unit":
+            units.add(parsed["unit"])
+        elif token_type == "item":
+            items.add(parsed["item"])
+        elif token_type == "equipped":
+            units.add(parsed["unit"])
+            items.add(parsed["item"])
             equipped.append((parsed["unit"], parsed["item"]))
-        elif parsed["type"] == "trait":
-            traits.append(parsed["trait"])
+        elif token_type == "trait":
+            traits.add(parsed["trait"])
 
     return {
         "type": "combo" if len(tokens) > 1 else get_token_type(tokens[0]),
-        "units": list(set(units)),
-        "items": list(set(items)),
+        "units": list(units),
+        "items": list(items),
         "equipped": equipped,
-        "traits": list(set(traits))
+        "traits": list(traits)
     }
 
 
+# (base units, items, equipped, base traits) token lists for /graph, built once per ENGINE.
+_graph_tokens_cache: tuple[tuple[str, ...], tuple[str, ...], tuple[str, ...], tuple[str, ...]] | None = None
+
+
+def _graph_tokens_by_type() -> tuple[tuple[str, ...], tuple[str, ...], tuple[str, ...], tuple[str, ...]]:
+    """
+    Return (base units, items, equipped, base traits) token tuples, in token-id order.
+
+    Star-level units (U:Unit:2) and tiered traits (T:Trait:2) are excluded.
+    """
+    global _graph_tokens_cache
+    if _graph_tokens_cache is None:
+        _graph_tokens_cache = (
+            tuple(t for t in ENGINE.get_all_tokens_by_type("U:") if ":" not in t[2:]),
+            tuple(ENGINE.get_all_tokens_by_type("I:")),
+            tuple(ENGINE.get_all_tokens_by_type("E:")),
+            tuple(t for t in ENGINE.get_all_tokens_by_type("T:") if ":" not in t[2:]),
+        )
+    return _graph_tokens_cache
+
+
+# item -> E: ids whose item name starts with it (e.g. InfinityEdge also covers
+# InfinityEdgeRadiant), memoized per ENGINE for item-centered /graph candidates.
+_equipped_ids_by_item_prefix: dict[str, BitMap] = {}
+
+
+def _equipped_ids_for_item_prefix(item: str) -> BitMap:
+    """Return E: token ids for every item name starting with `item`, in token-id order."""
+    ids = _equipped_ids_by_item_prefix.get(item)
+    if ids is None:
+        ids = BitMap()
+        for item_name, item_ids in ENGINE.equipped_ids_by_item.items():
+            if item_name.startswith(item):
+                ids |= item_ids
+        if item in ENGINE.equipped_ids_by_item:
+            # Only known items are memoized, so arbitrary query strings can't grow the dict.
+            _equipped_ids_by_item_prefix[item] = ids
+    return ids
+
+
 def generate_candidates(center_info: dict, current_tokens: list[str]) -> list[tuple[str, str]]:
     """
     Generate candidate tokens based on center type.
@@ -489,108 +826,174 @@ def generate_candidates(center_info: dict, current_tokens: list[str]) -> list[tu
     # Only include base unit tokens as candidates. Star-level unit tokens (U:Unit:2)
     # are available via search, but excluding them here prevents noisy/duplicative
     # suggestions and an explosion of root nodes.
-    all_units = [t for t in ENGINE.get_all_tokens_by_type("U:") if ":" not in t[2:]]
-    all_items = ENGINE.get_all_tokens_by_type("I:")
-    all_equipped = ENGINE.get_all_tokens_by_type("E:")
-    all_traits = [t for t in ENGINE.get_all_tokens_by_type("T:") if ":" not in t[2:]]  # Base traits only
+    all_units, all_items, _, all_traits = _graph_tokens_by_type()
+    id_to_token = ENGINE.id_to_token
 
     center_units = set(center_info["units"])
     center_items = set(center_info["items"])
     center_traits = set(center_info.get("traits", []))
 
+    def _add_cooccur(tokens: tuple[str, ...], excluded: set[str]) -> None:
+        # Ordered filter + pairing run in C (filterfalse/zip/repeat), not a bytecode loop.
+        candidates.extend(zip(filterfalse(excluded.__contains__, tokens), repeat("cooccur")))
+
     if center_info["type"] == "empty":
         # Show most popular units, items, and traits
-        for unit_token in all_units:
-            if unit_token not in current_set:
-                candidates.append((unit_token, "cooccur"))
-        for item_token in all_items:
-            if item_token not in current_set:
-                candidates.append((item_token, "cooccur"))
-        for trait_token in all_traits:
-            if trait_token not in current_set:
-                candidates.append((trait_token, "cooccur"))
+        _add_cooccur(all_units, current_set)
+        _add_cooccur(all_items, current_set)
+        _add_cooccur(all_traits, current_set)
 
     elif center_info["type"] == "trait":
         # Trait-centered: show co-occurring units and traits
-        for unit_token in all_units:
-            if unit_token not in current_set:
-                candidates.append((unit_token, "cooccur"))
-        for trait_token in all_traits:
-            if trait_token not in current_set:
-                trait_name = trait_token[2:]
-                if trait_name not in center_traits:
-                    candidates.append((trait_token, "cooccur"))
+        _add_cooccur(all_units, current_set)
+        _add_cooccur(all_traits, current_set | {f"T:{t}" for t in center_traits})
 
     elif center_info["type"] == "item" or (center_info["items"] and not center_info["units"]):
         # Item-centered: show units that equip these items
         for item in center_items:
-            for eq_token in all_equipped:
-                if eq_token not in current_set and f"|{item}" in eq_token:
+            for token_id in _equipped_ids_for_item_prefix(item):
+                eq_token = id_to_token[token_id]
+                if eq_token not in current_set:
                     candidates.append((eq_token, "equipped"))
 
         # Also show co-occurring items
-        for item_token in all_items:
-            if item_token not in current_set:
-                item_name = item_token[2:]
-                if item_name not in center_items:
-                    candidates.append((item_token, "cooccur"))
+        _add_cooccur(all_items, current_set | {f"I:{i}" for i in center_items})
 
         # Show co-occurring traits
-        for trait_token in all_traits:
-            if trait_token not in current_set:
-                candidates.append((trait_token, "cooccur"))
+        _add_cooccur(all_traits, current_set)
 
     elif center_info["type"] == "unit" or (center_info["units"] and not center_info["items"]):
         # Unit-centered: show items equipped on these units
         for unit in center_units:
-            prefix = f"E:{unit}|"
-            for eq_token in all_equipped:
-                if eq_token not in current_set and eq_token.startswith(prefix):
+            for token_id in ENGINE.equipped_ids_by_unit.get(unit, ()):
+                eq_token = id_to_token[token_id]
+                if eq_token not in current_set:
                     candidates.append((eq_token, "equipped"))
 
         # Also show co-occurring units
-        for unit_token in all_units:
-            if unit_token not in current_set:
-                unit_name = unit_token[2:]
-                if unit_name not in center_units:
-                    candidates.append((unit_token, "cooccur"))
+        _add_cooccur(all_units, current_set | {f"U:{u}" for u in center_units})
 
         # Show co-occurring traits
-        for trait_token in all_traits:
-            if trait_token not in current_set:
-                candidates.append((trait_token, "cooccur"))
+        _add_cooccur(all_traits, current_set)
 
     else:
         # Combo (unit + item via equipped edge)
         for unit in center_units:
-            prefix = f"E:{unit}|"
-            for eq_token in all_equipped:
-                if eq_token not in current_set and eq_token.startswith(prefix):
+            for token_id in ENGINE.equipped_ids_by_unit.get(unit, ()):
+                eq_token = id_to_token[token_id]
+                if eq_token not in current_set:
                     # Check item not in center
-                    parsed = parse_token(eq_token)
-                    item_name = parsed.get("item")
+                    item_name = ENGINE.item_name_by_tokenid[token_id]
                     if item_name and item_name not in center_items:
                         candidates.append((eq_token, "equipped"))
 
         # Show supporting units
-        for unit_token in all_units:
-            if unit_token not in current_set:
-                unit_name = unit_token[2:]
-                if unit_name not in center_units:
-                    candidates.append((unit_token, "cooccur"))
+        _add_cooccur(all_units, current_set | {f"U:{u}" for u in center_units})
 
         # Show co-occurring traits
-        for trait_token in all_traits:
-            if trait_token not in current_set:
-                trait_name = trait_token[2:]
-                if trait_name not in center_traits:
-                    candidates.append((trait_token, "cooccur"))
+        _add_cooccur(all_traits, current_set | {f"T:{t}" for t in center_traits})
 
     return candidates
 
 
-@app.get("/graph")
-def get_graph(
+def _graph_filter_and_score(
+    include_tokens: list[str],
+    exclude_tokens: list[str],
+    candidates: list[tuple[str, str]],
+    candidate_ids: np.ndarray,
+    min_sample: int,
+) -> tuple[int, float, list[dict]]:
+    """Compute the /graph base set and score candidates against it (runs in a worker thread)."""
+    base, n_base, avg_base = _filter_bitmap_cached(include_tokens, exclude_tokens)
+    if not base:
+        return n_base, avg_base, []
+
+    positions, n_with, avg_with = ENGINE.score_candidate_ids(base, candidate_ids, min_sample)
+    delta = avg_with - avg_base
+    avg_base_r = round(avg_base, 3)
+
+    scored = []
+    for pos, n, a, d in zip(positions.tolist(), n_with.tolist(), avg_with.tolist(), delta.tolist()):
+        scored.append({
+            "token": candidates[pos][0],
+            "delta": round(d, 3),
+            "avg_with": round(a, 3),
+            "avg_base": avg_base_r,
+            "n_with": n,
+            "n_base": n_base,
+        })
+    return n_base, avg_base, scored
+
+
+@lru_cache(maxsize=65536)
+def _graph_token_node_ids(token: str) -> tuple[str, str, str | None] | None:
+    """
+    Graph node ids for a scored /graph token: `(token type, node id, unit node id)`.
+
+    The unit node id is only set for equipped tokens (whose node id is the item). Ids
+    are interned and memoized, since the same neighbors recur across requests.
+    """
+    parsed = parse_token(token)
+    token_type = parsed["type"]
+    if token_type == "equipped":
+        return token_type, sys.intern(f"I:{parsed['item']}"), sys.intern(f"U:{parsed['unit']}")
+    if token_type == "unit":
+        return token_type, sys.intern(f"U:{parsed['unit']}"), None
+    if token_type == "item":
+        return token_type, sys.intern(f"I:{parsed['item']}"), None
+    if token_type == "trait":
+        if parsed.get("tier"):
+            return token_type, sys.intern(f"T:{parsed['trait']}:{parsed['tier']}"), None
+        return token_type, sys.intern(f"T:{parsed['trait']}"), None
+    return None
+
+
+@lru_cache(maxsize=64)
+def _graph_root_body(
+    allowed_item_types: frozenset[str] | None, allowed_item_prefixes: frozenset[str]
+) -> bytes:
+    """
+    Serialized /graph response for an empty token list (all root nodes).
+
+    Keyed on the parsed item filters; cleared by `_reset_engine_caches()`.
+    """
+    all_units, all_items, _, all_traits = _graph_tokens_by_type()
+
+    # Always apply set-prefix filtering:
+    # - Base items (no prefix) are always included
+    # - Prefixed set items are excluded unless selected via item_prefixes
+    def _item_allowed_root(item_name: str) -> bool:
+        item_type = get_item_type(item_name)
+        if allowed_item_types is not None and item_type not in allowed_item_types:
+            return False
+        prefix = get_item_prefix(item_name)
+        if prefix and prefix.lower() not in allowed_item_prefixes:
+            return False
+        return True
+
+    all_items = [t for t in all_items if _item_allowed_root(t[2:])]
+
+    nodes = []
+    for group, node_type in ((all_units, "unit"), (all_items, "item"), (all_traits, "trait")):
+        for t, label in zip(group, ENGINE.get_labels(group)):
+            nodes.append({"id": t, "label": label, "type": node_type, "isCenter": False})
+
+    return orjson.dumps(
+        {
+            "center": [],
+            "base": {
+                "n": ENGINE.total_matches,
+                "avg_placement": 4.5
+            },
+            "nodes": nodes,
+            "edges": []
+        },
+        option=orjson.OPT_SERIALIZE_NUMPY,
+    )
+
+
+@app.get("/graph", response_class=OrjsonResponse)
+async def get_graph(
     tokens: str = Query(default="", description="Comma-separated tokens"),
     min_sample: int = Query(default=10, description="Minimum sample size"),
     top_k: int = Query(default=15, description="Max edges to return (0 = unlimited)"),
@@ -615,64 +1018,35 @@ def get_graph(
         raise HTTPException(status_code=503, detail="Engine not loaded")
 
     token_list = [t.strip() for t in tokens.split(",") if t.strip()]
+    # Each token is parsed once here and the parses are reused for the center info,
+    # center nodes and edge sources below.
+    parsed_tokens = [parse_token(t) for t in token_list]
     include_tokens: list[str] = []
+    include_parsed: list[Mapping[str, Any]] = []
     exclude_tokens: list[str] = []
-    for t in token_list:
+    for t, parsed in zip(token_list, parsed_tokens):
         if t.startswith("-") or t.startswith("!"):
             raw = t.lstrip("-!")
             if raw:
                 exclude_tokens.append(raw)
         else:
             include_tokens.append(t)
+            include_parsed.append(parsed)
     active_types = set(t.strip().lower() for t in types.split(",") if t.strip())
     allowed_item_types = _parse_item_types_param(item_types)
     allowed_item_prefixes = _parse_item_prefixes_param(item_prefixes)
 
     if not token_list:
-        # Special case: return all root nodes (units, items, base traits)
-        all_units = [t for t in ENGINE.get_all_tokens_by_type("U:") if ":" not in t[2:]]
-        all_items = ENGINE.get_all_tokens_by_type("I:")
-        all_traits = [t for t in ENGINE.get_all_tokens_by_type("T:") if ":" not in t[2:]]
-
-        # Always apply set-prefix filtering:
-        # - Base items (no prefix) are always included
-        # - Prefixed set items are excluded unless selected via item_prefixes
-        def _item_allowed_root(item_name: str) -> bool:
-            item_type = get_item_type(item_name)
-            if allowed_item_types is not None and item_type not in allowed_item_types:
-                return False
-            prefix = get_item_prefix(item_name)
-            if prefix and prefix.lower() not in allowed_item_prefixes:
-                return False
-            return True
-
-        all_items = [t for t in all_items if _item_allowed_root(t[2:])]
-
-        nodes = []
-        for t in all_units:
-            nodes.append({"id": t, "label": ENGINE.get_label(t), "type": "unit", "isCenter": False})
-        for t in all_items:
-            nodes.append({"id": t, "label": ENGINE.get_label(t), "type": "item", "isCenter": False})
-        for t in all_traits:
-            nodes.append({"id": t, "label": ENGINE.get_label(t), "type": "trait", "isCenter": False})
-
-        return {
-            "center": [],
-            "base": {
-                "n": ENGINE.total_matches,
-                "avg_placement": 4.5
-            },
-            "nodes": nodes,
-            "edges": []
-        }
-
-    # Compute base set using include/exclude filters.
-    base = ENGINE.filter_bitmap(include_tokens, exclude_tokens)
-    n_base = len(base)
-    avg_base = ENGINE.avg_placement_for_bitmap(base) if n_base > 0 else 4.5
+        # Special case: return all root nodes (units, items, base traits). The body only
+        # depends on the item filters, so it's served pre-serialized.
+        body = _graph_root_body(
+            frozenset(allowed_item_types) if allowed_item_types is not None else None,
+            frozenset(allowed_item_prefixes),
+        )
+        return Response(content=body, media_type="application/json")
 
     # Get center info
-    center_info = get_center_info(include_tokens)
+    center_info = get_center_info(include_tokens, include_parsed)
 
     # Generate candidates
     candidates = generate_candidates(center_info, include_tokens + exclude_tokens)
@@ -682,38 +1056,40 @@ def get_graph(
     # - Prefixed set items are excluded unless selected via item_prefixes
     center_items = set(center_info.get("items") or [])
 
-    def _item_allowed(item_name: str) -> bool:
-        item_type = get_item_type(item_name)
-        if allowed_item_types is not None and item_type not in allowed_item_types:
+    # Item metadata comes from the engine's per-token tables instead of re-parsing
+    # every candidate token string.
+    item_name_by_tokenid = ENGINE.item_name_by_tokenid
+    item_type_by_tokenid = ENGINE.item_type_by_tokenid
+    item_prefix_by_tokenid = ENGINE.item_prefix_by_tokenid
+
+    def _item_allowed(token_id: int) -> bool:
+        if allowed_item_types is not None and item_type_by_tokenid[token_id] not in allowed_item_types:
             return False
-        prefix = get_item_prefix(item_name)
+        prefix = item_prefix_by_tokenid[token_id]
         if prefix and prefix.lower() not in allowed_item_prefixes:
             return False
         return True
 
-    filtered = []
-    for tok, edge_type in candidates:
-        parsed = parse_token(tok)
-        if parsed["type"] == "item":
-            if not _item_allowed(parsed["item"]):
-                continue
-        elif parsed["type"] == "equipped":
-            # Preserve equipped edges for explicitly-selected center items
-            if parsed["item"] not in center_items and not _item_allowed(parsed["item"]):
-                continue
-        filtered.append((tok, edge_type))
-    candidates = filtered
-
-    # Extract just token strings for scoring
-    candidate_tokens = [t for t, _ in candidates]
-    edge_types = {t: e for t, e in candidates}
-
-    # Score candidates using optimized engine
-    scored = ENGINE.score_candidates(base, candidate_tokens, min_sample)
-
-    # Add edge types
-    for score in scored:
-        score["edge_type"] = edge_types.get(score["token"], "cooccur")
+    # Single pass: keep non-item candidates, equipped edges for explicitly-selected
+    # center items, and items that pass the type/prefix filters.
+    candidate_ids = ENGINE.token_ids([t for t, _ in candidates])
+    keep = [
+        pos
+        for pos, token_id in enumerate(candidate_ids.tolist())
+        if token_id < 0
+        or (item_name := item_name_by_tokenid[token_id]) is None
+        or (candidates[pos][0].startswith("E:") and item_name in center_items)
+        or _item_allowed(token_id)
+    ]
+    candidates = [candidates[pos] for pos in keep]
+    candidate_ids = candidate_ids[keep]
+
+    # Bitmap filtering + candidate scoring are the only heavy steps: run them in one
+    # worker-thread hop and keep token parsing / response building on the event loop.
+    # Candidates are scored by id; results map back to their token by position.
+    n_base, avg_base, scored = await anyio.to_thread.run_sync(
+        _graph_filter_and_score, include_tokens, exclude_tokens, candidates, candidate_ids, min_sample
+    )
 
     # Filter by active types before applying top_k
     # equipped edges are included if either unit or item is in active_types
@@ -726,261 +1102,109 @@ def get_graph(
 
     scored = [s for s in scored if matches_type_filter(s)]
 
-    # Sort based on sort_mode
+    # Sort based on sort_mode, applying top_k (if specified) to the filtered results.
+    # With a limit, a heap selection avoids sorting every candidate.
     if sort_mode == "helpful":
         # Most helpful first (most negative delta = improves placement most)
-        scored.sort(key=lambda x: x["delta"])
+        key, reverse = (lambda x: x["delta"]), False
     elif sort_mode == "harmful":
         # Most harmful first (most positive delta = worsens placement most)
-        scored.sort(key=lambda x: x["delta"], reverse=True)
+        key, reverse = (lambda x: x["delta"]), True
     else:
         # Default: impact (abs delta, most impactful first)
-        scored.sort(key=lambda x: abs(x["delta"]), reverse=True)
+        key, reverse = (lambda x: abs(x["delta"])), True
 
-    # Apply top_k limit if specified (now applied to filtered results)
-    if top_k > 0:
-        scored = scored[:top_k]
+    if 0 < top_k < len(scored):
+        scored = (heapq.nlargest if reverse else heapq.nsmallest)(top_k, scored, key=key)
+    else:
+        scored.sort(key=key, reverse=reverse)
 
     # Build nodes
     nodes = []
     node_ids = set()
 
-    # Add center nodes
-    for t in token_list:
-        parsed = parse_token(t)
-        if parsed["type"] == "unit":
-            node_id = f"U:{parsed['unit']}"
-            if node_id not in node_ids:
-                label = ENGINE.get_label(node_id)
-                if parsed.get("negated"):
-                    label = f"Not {label}"
-                nodes.append({
-                    "id": node_id,
-                    "label": label,
-                    "type": "unit",
-                    "negated": bool(parsed.get("negated")),
-                    "isCenter": True
-                })
-                node_ids.add(node_id)
-        elif parsed["type"] == "item":
-            node_id = f"I:{parsed['item']}"
-            if node_id not in node_ids:
-                label = ENGINE.get_label(node_id)
-                if parsed.get("negated"):
-                    label = f"Not {label}"
-                nodes.append({
-                    "id": node_id,
-                    "label": label,
-                    "type": "item",
-                    "negated": bool(parsed.get("negated")),
-                    "isCenter": True
-                })
-                node_ids.add(node_id)
-        elif parsed["type"] == "trait":
-            if parsed.get("tier"):
-                node_id = f"T:{parsed['trait']}:{parsed['tier']}"
-            else:
-                node_id = f"T:{parsed['trait']}"
-            if node_id not in node_ids:
-                label = ENGINE.get_label(node_id)
-                if parsed.get("negated"):
-                    label = f"Not {label}"
-                nodes.append({
-                    "id": node_id,
-                    "label": label,
-                    "type": "trait",
-                    "negated": bool(parsed.get("negated")),
-                    "isCenter": True
-                })
-                node_ids.add(node_id)
-        elif parsed["type"] == "equipped":
-            unit_id = f"U:{parsed['unit']}"
-            item_id = f"I:{parsed['item']}"
-            if unit_id not in node_ids:
-                nodes.append({
-                    "id": unit_id,
-                    "label": ENGINE.get_label(unit_id),
-                    "type": "unit",
-                    "isCenter": True
-                })
-                node_ids.add(unit_id)
-            if item_id not in node_ids:
-                nodes.append({
-                    "id": item_id,
-                    "label": ENGINE.get_label(item_id),
-                    "type": "item",
-                    "isCenter": True
-                })
-                node_ids.add(item_id)
-
-    # Build edges and add neighbor nodes
-    edges = []
-    for score in scored:
-        parsed = parse_token(score["token"])
-
-        if parsed["type"] == "equipped":
-            from_id = f"U:{parsed['unit']}"
-            to_id = f"I:{parsed['item']}"
-
-            if from_id not in node_ids:
-                nodes.append({
-                    "id": from_id,
-                    "label": ENGINE.get_label(from_id),
-                    "type": "unit",
-                    "isCenter": False
-                })
-                node_ids.add(from_id)
-            if to_id not in node_ids:
-                nodes.append({
-                    "id": to_id,
-                    "label": ENGINE.get_label(to_id),
-                    "type": "item",
-                    "isCenter": False
-                })
-                node_ids.add(to_id)
-
-            edges.append({
-                "from": from_id,
-                "to": to_id,
-                "token": score["token"],
-                "label": ENGINE.get_label(score["token"]),
-                "type": "equipped",
-                "delta": score["delta"],
-                "avg_with": score["avg_with"],
-                "avg_base": score["avg_base"],
-                "n_with": score["n_with"],
-                "n_base": score["n_base"]
+    # Add center nodes (node ids come from the same memoized table as the neighbors)
+    get_label = ENGINE.get_label
+    for t, parsed in zip(token_list, parsed_tokens):
+        token_node_ids = _graph_token_node_ids(t)
+        if token_node_ids is None:
+            continue
+        token_type, node_id, unit_id = token_node_ids
+        if token_type == "equipped":
+            for center_id, center_type in ((unit_id, "unit"), (node_id, "item")):
+                if center_id not in node_ids:
+                    nodes.append({
+                        "id": center_id,
+                        "label": get_label(center_id),
+                        "type": center_type,
+                        "isCenter": True
+                    })
+                    node_ids.add(center_id)
+        elif node_id not in node_ids:
+            negated = bool(parsed.get("negated"))
+            label = get_label(node_id)
+            if negated:
+                label = f"Not {label}"
+            nodes.append({
+                "id": node_id,
+                "label": label,
+                "type": token_type,
+                "negated": negated,
+                "isCenter": True
             })
-
-        elif parsed["type"] == "unit":
-            node_id = f"U:{parsed['unit']}"
-            if node_id not in node_ids:
-                nodes.append({
-                    "id": node_id,
-                    "label": ENGINE.get_label(node_id),
-                    "type": "unit",
-                    "isCenter": False
-                })
-                node_ids.add(node_id)
-
-            if token_list:
-                center_parsed = parse_token(token_list[0])
-                if center_parsed["type"] == "unit":
-                    from_id = f"U:{center_parsed['unit']}"
-                elif center_parsed["type"] == "item":
-                    from_id = f"I:{center_parsed['item']}"
-                elif center_parsed["type"] == "equipped":
-                    from_id = f"U:{center_parsed['unit']}"
-                elif center_parsed["type"] == "trait":
-                    if center_parsed.get("tier"):
-                        from_id = f"T:{center_parsed['trait']}:{center_parsed['tier']}"
-                    else:
-                        from_id = f"T:{center_parsed['trait']}"
-                else:
-                    from_id = node_id
-            else:
-                from_id = node_id
-
-            edges.append({
-                "from": from_id,
-                "to": node_id,
-                "token": score["token"],
-                "label": ENGINE.get_label(score["token"]),
-                "type": "cooccur",
-                "delta": score["delta"],
-                "avg_with": score["avg_with"],
-                "avg_base": score["avg_base"],
-                "n_with": score["n_with"],
-                "n_base": score["n_base"]
+            node_ids.add(node_id)
+
+    # Build edges and add neighbor nodes.
+    # Co-occur edges all start from the first center token's node (an equipped center
+    # anchors item edges on its item, everything else on its unit).
+    center_node_ids = _graph_token_node_ids(token_list[0])
+    if center_node_ids is None:
+        center_from_id = item_from_id = None
+    elif center_node_ids[0] == "equipped":
+        center_from_id, item_from_id = center_node_ids[2], center_node_ids[1]
+    else:
+        center_from_id = item_from_id = center_node_ids[1]
+
+    def _add_neighbor(node_id: str, node_type: str) -> None:
+        if node_id not in node_ids:
+            nodes.append({
+                "id": node_id,
+                "label": None,
+                "type": node_type,
+                "isCenter": False
             })
+            node_ids.add(node_id)
 
-        elif parsed["type"] == "item":
-            node_id = f"I:{parsed['item']}"
-            if node_id not in node_ids:
-                nodes.append({
-                    "id": node_id,
-                    "label": ENGINE.get_label(node_id),
-                    "type": "item",
-                    "isCenter": False
-                })
-                node_ids.add(node_id)
-
-            if token_list:
-                center_parsed = parse_token(token_list[0])
-                if center_parsed["type"] == "unit":
-                    from_id = f"U:{center_parsed['unit']}"
-                elif center_parsed["type"] == "item":
-                    from_id = f"I:{center_parsed['item']}"
-                elif center_parsed["type"] == "equipped":
-                    from_id = f"I:{center_parsed['item']}"
-                elif center_parsed["type"] == "trait":
-                    if center_parsed.get("tier"):
-                        from_id = f"T:{center_parsed['trait']}:{center_parsed['tier']}"
-                    else:
-                        from_id = f"T:{center_parsed['trait']}"
-                else:
-                    from_id = node_id
-            else:
-                from_id = node_id
-
-            edges.append({
-                "from": from_id,
-                "to": node_id,
-                "token": score["token"],
-                "label": ENGINE.get_label(score["token"]),
-                "type": "cooccur",
-                "delta": score["delta"],
-                "avg_with": score["avg_with"],
-                "avg_base": score["avg_base"],
-                "n_with": score["n_with"],
-                "n_base": score["n_base"]
-            })
+    edges = []
+    for score in scored:
+        token_node_ids = _graph_token_node_ids(score["token"])
+        if token_node_ids is None:
+            continue
+        token_type, to_id, unit_id = token_node_ids
 
-        elif parsed["type"] == "trait":
-            if parsed.get("tier"):
-                node_id = f"T:{parsed['trait']}:{parsed['tier']}"
-            else:
-                node_id = f"T:{parsed['trait']}"
-
-            if node_id not in node_ids:
-                nodes.append({
-                    "id": node_id,
-                    "label": ENGINE.get_label(node_id),
-                    "type": "trait",
-                    "isCenter": False
-                })
-                node_ids.add(node_id)
-
-            if token_list:
-                center_parsed = parse_token(token_list[0])
-                if center_parsed["type"] == "unit":
-                    from_id = f"U:{center_parsed['unit']}"
-                elif center_parsed["type"] == "item":
-                    from_id = f"I:{center_parsed['item']}"
-                elif center_parsed["type"] == "equipped":
-                    from_id = f"U:{center_parsed['unit']}"
-                elif center_parsed["type"] == "trait":
-                    if center_parsed.get("tier"):
-                        from_id = f"T:{center_parsed['trait']}:{center_parsed['tier']}"
-                    else:
-                        from_id = f"T:{center_parsed['trait']}"
-                else:
-                    from_id = node_id
-            else:
-                from_id = node_id
-
-            edges.append({
-                "from": from_id,
-                "to": node_id,
-                "token": score["token"],
-                "label": ENGINE.get_label(score["token"]),
-                "type": "cooccur",
-                "delta": score["delta"],
-                "avg_with": score["avg_with"],
-                "avg_base": score["avg_base"],
-                "n_with": score["n_with"],
-                "n_base": score["n_base"]
-            })
+        if token_type == "equipped":
+            from_id = unit_id
+            _add_neighbor(from_id, "unit")
+            _add_neighbor(to_id, "item")
+            edge_type = "equipped"
+        else:
+            _add_neighbor(to_id, token_type)
+            from_id = (item_from_id if token_type == "item" else center_from_id) or to_id
+            edge_type = "cooccur"
+
+        # Score dicts are built fresh per request, so each one becomes its edge in place
+        # (token + stats already set) instead of being copied into a new dict.
+        score["from"] = from_id
+        score["to"] = to_id
+        score["label"] = None
+        score["type"] = edge_type
+        edges.append(score)
+
+    # Neighbor node and edge labels are filled in with one bulk lookup.
+    unlabeled = [n for n in nodes if n["label"] is None]
+    labels = ENGINE.get_labels([n["id"] for n in unlabeled] + [e["token"] for e in edges])
+    for obj, label in zip(unlabeled + edges, labels):
+        obj["label"] = label
 
     return {
         "center": token_list,
@@ -1143,30 +1367,68 @@ def search_tokens(q: str = Query(..., description="Search query")):
     if not q_norm:
         return []
 
-    results = []
-    for entry in _get_search_index():
-        if q_norm in entry["_label_norm"] or q_norm in entry["_token_norm"]:
-            results.append({
-                "token": entry["token"],
-                "label": entry["label"],
-                "type": entry["type"],
-                "count": entry["count"],
-            })
+    ranked, trigram_index, norm_buf, starts = _get_search_trigram_index()
+    find = norm_buf.find
+    # Entries are in count-desc order, so the first 20 matches are the answer. The
+    # query is alphanumeric, so a match can never span an entry's "\x00" separators.
+    hits: list[int] = []
+    if len(q_norm) >= 3:
+        # Any match contains every query trigram, so the shortest posting list is a
+        # complete candidate set; it only needs substring verification.
+        postings = [trigram_index.get(q_norm[i:i + 3], ()) for i in range(len(q_norm) - 2)]
+        for rank in min(postings, key=len):
+            if find(q_norm, starts[rank], starts[rank + 1]) >= 0:
+                hits.append(rank)
+                if len(hits) == 20:
+                    break
+    else:
+        # Short queries: jump between occurrences in the shared buffer.
+        pos = find(q_norm)
+        while pos >= 0 and len(hits) < 20:
+            rank = bisect_right(starts, pos) - 1
+            hits.append(rank)
+            pos = find(q_norm, starts[rank + 1])
+
+    return [
+        {"token": entry.token, "label": entry.label, "type": entry.type, "count": entry.count}
+        for entry in map(ranked.__getitem__, hits)
+    ]
+
+
+@dataclass(frozen=True, slots=True)
+class _SearchEntry:
+    token: str
+    label: str
+    type: str
+    count: int
 
-    results.sort(key=lambda x: x["count"], reverse=True)
-    return results[:20]
 
+_SEARCH_TOKEN_PREFIXES = frozenset(("U:", "I:", "T:", "E:"))
 
 # Cache for client-side search index
-_search_index_cache = None
+_search_index_cache: list[_SearchEntry] | None = None
+# Search entries ranked by count (desc, stable), trigram -> ascending ranks containing
+# it, and the entries' normalized label/token text packed into one "\x00"-separated
+# buffer (rank r spans starts[r]:starts[r + 1]).
+_search_trigram_cache: tuple[list[_SearchEntry], dict[str, list[int]], str, array] | None = None
+# Serialized /search-index response body.
+_search_index_body: bytes | None = None
 
 
+# Non-alphanumeric ASCII bytes, deleted in one C-level bytes.translate pass.
+_ASCII_NON_ALNUM = bytes(b for b in range(128) if not chr(b).isalnum())
+
+
+@lru_cache(maxsize=4096)
 def _normalize_search_text(text: str) -> str:
-    """Normalize search text for fast, forgiving matching."""
-    return "".join(ch for ch in text.lower() if ch.isalnum())
+    """Normalize search text for fast, forgiving matching (memoized; queries repeat)."""
+    text = text.lower()
+    if text.isascii():
+        return text.encode("ascii").translate(None, _ASCII_NON_ALNUM).decode("ascii")
+    return "".join(ch for ch in text if ch.isalnum())
 
 
-def _get_search_index():
+def _get_search_index() -> list[_SearchEntry]:
     """
     Build or return cached search index.
 
@@ -1180,44 +1442,73 @@ def _get_search_index():
     if ENGINE is None:
         return []
 
+    labels = ENGINE.labels
+    tokens = ENGINE.tokens
     entries = []
-    for token_str in ENGINE.id_to_token:
-        if not (
-            token_str.startswith("U:")
-            or token_str.startswith("I:")
-            or token_str.startswith("T:")
-            or token_str.startswith("E:")
-        ):
+    for token_id, token_str in enumerate(ENGINE.id_to_token):
+        if token_str[:2] not in _SEARCH_TOKEN_PREFIXES:
             continue
 
-        label = ENGINE.get_label(token_str)
-        entries.append({
-            "token": token_str,
-            "label": label,
-            "type": get_token_type(token_str),
-            "count": ENGINE.get_token_count(token_str),
-            "_label_norm": _normalize_search_text(label),
-            "_token_norm": _normalize_search_text(token_str),
-        })
+        label = labels.get(token_id, token_str)
+        stats = tokens.get(token_id)
+        entries.append(_SearchEntry(
+            token=token_str,
+            label=label,
+            type=get_token_type(token_str),
+            count=stats.count if stats is not None else 0,
+        ))
 
     _search_index_cache = entries
     return _search_index_cache
 
 
+def _get_search_trigram_index() -> tuple[list[_SearchEntry], dict[str, list[int]], str, array]:
+    """Build or return the count-ranked search entries, trigram postings and text buffer."""
+    global _search_trigram_cache
+    if _search_trigram_cache is not None:
+        return _search_trigram_cache
+
+    entries = _get_search_index()
+    if not entries:
+        return [], {}, "", array("I", [0])
+
+    ranked = sorted(entries, key=lambda e: e.count, reverse=True)
+    trigram_index: dict[str, list[int]] = {}
+    parts: list[str] = []
+    starts = array("I", [0])
+    for rank, entry in enumerate(ranked):
+        grams = set()
+        for text in (_normalize_search_text(entry.label), _normalize_search_text(entry.token)):
+            grams.update(text[i:i + 3] for i in range(len(text) - 2))
+            parts.append(text)
+            parts.append("\x00")
+            starts.append(starts[-1] + len(text) + 1)
+        # Only the entry boundary is kept; the inner separator stays in the buffer.
+        del starts[-2]
+        for gram in grams:
+            trigram_index.setdefault(gram, []).append(rank)
+
+    _search_trigram_cache = (ranked, trigram_index, "".join(parts), starts)
+    return _search_trigram_cache
+
+
 @app.get("/search-index")
 def get_search_index():
     """Return full search index for client-side search (no per-keystroke API calls)."""
     if ENGINE is None:
         raise HTTPException(status_code=503, detail="Engine not loaded")
 
-    return [
-        {"token": e["token"], "label": e["label"], "type": e["type"], "count": e["count"]}
-        for e in _get_search_index()
-    ]
+    global _search_index_body
+    if _search_index_body is None:
+        _search_index_body = orjson.dumps([
+            {"token": e.token, "label": e.label, "type": e.type, "count": e.count}
+            for e in _get_search_index()
+        ])
+    return Response(content=_search_index_body, media_type="application/json")
 
 
-# Cache for item filter options (prefixes/types)
-_item_filters_cache = None
+# Cache for item filter options (prefixes/types), as the serialized response body
+_item_filters_cache: bytes | None = None
 
 
 @app.get("/item-filters")
@@ -1231,24 +1522,33 @@ def get_item_filters():
     if ENGINE is None:
         raise HTTPException(status_code=503, detail="Engine not loaded")
 
+    return Response(content=_get_item_filters(), media_type="application/json")
+
+
+def _get_item_filters() -> bytes:
+    """Build or return the serialized /item-filters payload (warmed at engine load)."""
     global _item_filters_cache
     if _item_filters_cache is not None:
         return _item_filters_cache
 
-    # Build from item presence tokens (I:*) so it matches graph item nodes.
-    item_names = [t[2:] for t in ENGINE.id_to_token if t.startswith("I:")]
+    # Build from item presence tokens (I:*) so it matches graph item nodes. Item
+    # type/prefix come from the engine's per-token tables (classified once at load).
+    item_type_by_tokenid = ENGINE.item_type_by_tokenid
+    item_prefix_by_tokenid = ENGINE.item_prefix_by_tokenid
 
     type_counts: dict[str, int] = {k: 0 for k in ("component", "full", "artifact", "emblem", "radiant")}
     prefix_to_items: dict[str, set[str]] = {}
 
-    for name in item_names:
-        item_type = get_item_type(name)
+    for token_id, token_str in enumerate(ENGINE.id_to_token):
+        if not token_str.startswith("I:"):
+            continue
+        item_type = item_type_by_tokenid[token_id]
         if item_type in type_counts:
             type_counts[item_type] += 1
 
-        prefix = get_item_prefix(name)
+        prefix = item_prefix_by_tokenid[token_id]
         if prefix:
-            prefix_to_items.setdefault(prefix, set()).add(name)
+            prefix_to_items.setdefault(prefix, set()).add(token_str[2:])
 
     # Only show prefixes that actually represent a "set" (2+ distinct items).
     prefixes = [
@@ -1258,7 +1558,7 @@ def get_item_filters():
     ]
     prefixes.sort(key=lambda x: (-x["n_items"], x["key"].lower()))
 
-    _item_filters_cache = {
+    _item_filters_cache = orjson.dumps({
         "item_types": [
             {"key": "full", "label": "Full items", "n_items": type_counts["full"]},
             {"key": "radiant", "label": "Radiant", "n_items": type_counts["radiant"]},
@@ -1267,29 +1567,38 @@ def get_item_filters():
             {"key": "component", "label": "Components", "n_items": type_counts["component"]},
         ],
         "item_prefixes": prefixes,
-    }
+    })
     return _item_filters_cache
 
 
 # Cache for voice parsing vocabulary context
 _voice_vocab_cache = None
 
+# Engine trait labels include the inferred first breakpoint number (e.g. "Demacia 3").
+_TRAIT_BREAKPOINT_RE = re.compile(r"(?:\s|:)\d+\s*$")
+
 
 def _get_voice_vocab():
     """Get cached vocabulary for voice parsing."""
     global _voice_vocab_cache
     if _voice_vocab_cache is None and ENGINE is not None:
-        import re
-
-        unit_tokens = [t for t in ENGINE.id_to_token if t.startswith("U:")]
-        base_unit_tokens = [t for t in unit_tokens if ":" not in t[2:]]
-        star_unit_tokens = [t for t in unit_tokens if ":" in t[2:]]
+        # One classification pass over the vocabulary (prefix + "has a suffix" check).
+        base_unit_tokens: list[str] = []
+        star_unit_tokens: list[str] = []
+        item_tokens: list[str] = []
+        trait_tokens: list[str] = []
+        base_trait_tokens: list[str] = []
+        for t in ENGINE.id_to_token:
+            prefix = t[:2]
+            if prefix == "U:":
+                (base_unit_tokens if t.find(":", 2) < 0 else star_unit_tokens).append(t)
+            elif prefix == "I:":
+                item_tokens.append(t)
+            elif prefix == "T:":
+                trait_tokens.append(t)
+                if t.find(":", 2) < 0:
+                    base_trait_tokens.append(t)
         units = [ENGINE.get_label(t) for t in base_unit_tokens + star_unit_tokens]
-        base_trait_tokens = [t for t in ENGINE.id_to_token if t.startswith("T:") and ":" not in t[2:]]
-
-        def _strip_breakpoint(label: str) -> str:
-            # Engine trait labels include the inferred first breakpoint number (e.g. "Demacia 3").
-            return re.sub(r"(?:\s|:)\d+\s*$", "", label or "").strip()
 
         # Build unit label -> token lookup for forgiving matching
         unit_lookup = {}
@@ -1309,22 +1618,21 @@ def _get_voice_vocab():
         # Build item label -> token lookup for fast matching
         item_lookup = {}
         items = []
-        for t in ENGINE.id_to_token:
-            if t.startswith("I:"):
-                label = ENGINE.get_label(t)
-                keys = [
-                    label.lower().replace(" ", ""),
-                    _normalize_search_text(label),
-                    t[2:].lower(),  # canonical item id (e.g. RunaansHurricane)
-                    _normalize_search_text(t[2:]),
-                ]
-                added_any = False
-                for key in keys:
-                    if key and key not in item_lookup:
-                        item_lookup[key] = t
-                        added_any = True
-                if added_any:
-                    items.append(label)
+        for t in item_tokens:
+            label = ENGINE.get_label(t)
+            keys = [
+                label.lower().replace(" ", ""),
+                _normalize_search_text(label),
+                t[2:].lower(),  # canonical item id (e.g. RunaansHurricane)
+                _normalize_search_text(t[2:]),
+            ]
+            added_any = False
+            for key in keys:
+                if key and key not in item_lookup:
+                    item_lookup[key] = t
+                    added_any = True
+            if added_any:
+                items.append(label)
 
         # Build trait name -> token lookup
         trait_lookup = {}
@@ -1332,7 +1640,7 @@ def _get_voice_vocab():
         for t in base_trait_tokens:
             trait_id = t[2:]
             label = ENGINE.get_label(t)
-            display = _strip_breakpoint(label) or trait_id
+            display = _TRAIT_BREAKPOINT_RE.sub("", label or "").strip() or trait_id
             traits.append(display)
 
             keys = [
@@ -1348,9 +1656,7 @@ def _get_voice_vocab():
         # Build trait label (with inferred breakpoint numbers) -> token lookup.
         # Example: "Demacia 5" -> "T:Demacia:2"
         trait_tier_lookup = {}
-        for t in ENGINE.id_to_token:
-            if not t.startswith("T:"):
-                continue
+        for t in trait_tokens:
             label = ENGINE.get_label(t)
             keys = [
                 label.lower().replace(" ", ""),
@@ -1360,6 +1666,14 @@ def _get_voice_vocab():
                 if key and key not in trait_tier_lookup:
                     trait_tier_lookup[key] = t
 
+        # Merged key -> {kind: token} view used by voice validation, so a name is probed
+        # once for every category instead of once per category fallback. The per-kind
+        # dicts stay as-is for the /voice-vocab client payload.
+        kind_lookup: dict[str, dict[str, str]] = {}
+        for kind, lookup in (("unit", unit_lookup), ("item", item_lookup), ("trait", trait_lookup)):
+            for key, t in lookup.items():
+                kind_lookup.setdefault(key, {})[kind] = t
+
         _voice_vocab_cache = {
             "units": sorted(set(units)),
             "items": sorted(set(items)),
@@ -1368,76 +1682,81 @@ def _get_voice_vocab():
             "item_lookup": item_lookup,
             "trait_lookup": trait_lookup,
             "trait_tier_lookup": trait_tier_lookup,
+            "kind_lookup": kind_lookup,
         }
     return _voice_vocab_cache
 
 
-def _fuzzy_lookup(name: str, lookup: dict) -> str | None:
-    """Try to find a match with fuzzy matching for plurals and common variations."""
-    raw = name.lower()
-    keys = [
-        raw.replace(" ", ""),
-        _normalize_search_text(raw),
-    ]
+@lru_cache(maxsize=4096)
+def _fuzzy_keys(name: str) -> tuple[str, ...]:
+    """
+    Fuzzy lookup keys for a spoken name, in priority order (duplicates dropped).
 
-    for key in keys:
-        # Try exact match first
-        if key in lookup:
-            return lookup[key]
+    Each normalized form is tried exactly, then without a trailing 's' (plurals), then
+    without a trailing 'es' (plurals like "cashes" -> "cash").
+    """
+    raw = name.lower()
+    keys = []
+    for key in dict.fromkeys((raw.replace(" ", ""), _normalize_search_text(raw))):
+        keys.append(key)
+        if key.endswith("s"):
+            keys.append(key[:-1])
+        if key.endswith("es"):
+            keys.append(key[:-2])
+    return tuple(keys)
 
-        # Try removing trailing 's' (plurals)
-        if key.endswith('s') and key[:-1] in lookup:
-            return lookup[key[:-1]]
 
-        # Try removing trailing 'es' (plurals like "cashes" -> "cash")
-        if key.endswith('es') and key[:-2] in lookup:
-            return lookup[key[:-2]]
+def _fuzzy_lookup_kinds(name: str, kind_lookup: dict[str, dict[str, str]], kinds: tuple[str, ...]) -> tuple[str, str] | None:
+    """
+    Fuzzy-match a name for plurals and common variations, returning `(kind, token)`.
 
+    Kinds are tried in `kinds` order (cross-category fallback, since the model can
+    miscategorize), but every fuzzy key is probed only once.
+    """
+    hits = [kind_lookup[key] for key in _fuzzy_keys(name) if key in kind_lookup]
+    for kind in kinds:
+        for hit in hits:
+            token = hit.get(kind)
+            if token is not None:
+                return kind, token
     return None
 
 
 def _validate_voice_tokens(tool_args: dict, vocab: dict) -> list:
     """Validate and convert tool call arguments to tokens."""
-    tokens = []
-    seen_tokens = set()
-    unit_lookup = vocab.get("unit_lookup", {})
-    item_lookup = vocab.get("item_lookup", {})
-    trait_lookup = vocab.get("trait_lookup", {})
+    # token -> entry; insertion order is the response order, first occurrence wins.
+    tokens: dict[str, dict] = {}
+    kind_lookup = vocab.get("kind_lookup", {})
 
     def add_token(token, label, token_type):
-        if token not in seen_tokens:
-            seen_tokens.add(token)
-            tokens.append({"token": token, "label": label, "type": token_type})
+        if token not in tokens:
+            tokens[token] = {"token": token, "label": label, "type": token_type}
+
+    def add_match(match: tuple[str, str] | None) -> None:
+        if match is None:
+            return
+        kind, token = match
+        if kind == "trait":
+            add_token(token, token[2:], "trait")
+        else:
+            add_token(token, ENGINE.get_label(token), kind)
 
-    # Handle units - fuzzy lookup with cross-category fallback
+    # Handle units - fuzzy lookup with cross-category fallback (model might miscategorize)
     for unit_name in tool_args.get("units", []):
-        unit_token = _fuzzy_lookup(unit_name, unit_lookup)
-        if unit_token:
-            add_token(unit_token, ENGINE.get_label(unit_token), "unit")
-        else:
-            # Try as trait (model might miscategorize)
-            trait_token = _fuzzy_lookup(unit_name, trait_lookup)
-            if trait_token:
-                add_token(trait_token, trait_token[2:], "trait")
+        add_match(_fuzzy_lookup_kinds(unit_name, kind_lookup, ("unit", "trait")))
 
     # Handle items - fuzzy lookup with cross-category fallback
     for item_name in tool_args.get("items", []):
-        item_token = _fuzzy_lookup(item_name, item_lookup)
-        if item_token:
-            add_token(item_token, ENGINE.get_label(item_token), "item")
-        else:
-            # Try as trait
-            trait_token = _fuzzy_lookup(item_name, trait_lookup)
-            if trait_token:
-                add_token(trait_token, trait_token[2:], "trait")
+        add_match(_fuzzy_lookup_kinds(item_name, kind_lookup, ("item", "trait")))
 
     # Handle traits - fuzzy lookup with tier support and cross-category fallback
     for trait in tool_args.get("traits", []):
         name = trait.get("name", "") if isinstance(trait, dict) else str(trait)
         tier = trait.get("tier") if isinstance(trait, dict) else None
-        base_token = _fuzzy_lookup(name, trait_lookup)
+        match = _fuzzy_lookup_kinds(name, kind_lookup, ("trait", "unit"))
 
-        if base_token:
+        if match is not None and match[0] == "trait":
+            base_token = match[1]
             trait_name = base_token[2:]  # Remove "T:" prefix
             if tier and tier >= 2:
                 token = f"T:{trait_name}:{tier}"
@@ -1447,12 +1766,9 @@ def _validate_voice_tokens(tool_args: dict, vocab: dict) -> list:
                 label = trait_name
             add_token(token, label, "trait")
         else:
-            # Try as unit (model might miscategorize)
-            unit_token = _fuzzy_lookup(name, unit_lookup)
-            if unit_token:
-                add_token(unit_token, ENGINE.get_label(unit_token), "unit")
+            add_match(match)
 
-    return tokens
+    return list(tokens.values())
 
 
 def _get_realtime_session_config():
@@ -1464,38 +1780,13 @@ def _get_realtime_session_config():
     }
 
 
-def _get_session_update_event():
-    """Build session.update event to configure tools after connection."""
-    vocab = _get_voice_vocab()
-    if not vocab:
-        return None
+# The realtime session config is static, so its multipart JSON field is encoded once.
+_REALTIME_SESSION_CONFIG_JSON: bytes = orjson.dumps(_get_realtime_session_config())
 
-    instructions = """You are a TFT (Teamfight Tactics) voice command parser for the Smeecher UI. Extract ALL game entities the user mentions AND any UI intent.
 
-ITEM ABBREVIATIONS (expand before calling tool):
-hoj=Hand of Justice, jg=Jeweled Gauntlet, tg=Thief's Gloves, ie=Infinity Edge, bt=Bloodthirster, gs=Giant Slayer, lw=Last Whisper, db=Deathblade, ga=Guardian Angel, qss=Quicksilver, rfc=Rapid Firecannon, rb=Guinsoo's Rageblade, tr=Titan's Resolve, dcap=Rabadon's Deathcap, shiv=Statikk Shiv, shojin=Spear of Shojin, blue=Blue Buff, nashors=Nashor's Tooth, archangels=Archangel's Staff, morello=Morellonomicon, sunfire=Sunfire Cape, ionic=Ionic Spark, shroud=Shroud of Stillness, eon=Edge of Night, gargoyle=Gargoyle Stoneplate, bramble=Bramble Vest, dclaw=Dragon's Claw, warmogs=Warmog's Armor, zzrot=Zz'Rot Portal, hullbreaker=Hullcrusher, cg=Crownguard
-
-UI INTENT (set these fields when the user asks for it):
-- If the user asks for best items/builds (e.g., "best artifacts for ashe"), set open_item_explorer=true.
-- If the user asks for best comp(s)/composition(s)/archetype(s) (e.g., "best yasuo comp"), set open_cluster_explorer=true (and run_cluster_explorer=true).
-- If the user mentions item categories, set item_types to the matching keys: component, full, radiant, artifact, emblem.
-- If the user says "best"/"top", set item_explorer_sort_mode="helpful"; if "worst"/"bad", set "harmful"; if "impact"/"most impact", set "impact"; if "necessary"/"necessity", set "necessity".
-- If the user says "build(s)", set item_explorer_tab="builds"; if they say "item(s)" or mention an item category, set item_explorer_tab="items".
-- If the user says a unit is "with"/"holding"/"equipped with" an item, put that in equipped=[{unit, item}].
-
-EXCLUSION / NEGATION:
-- If the user says "without", "no", "exclude", "not", "minus", or uses similar negation language, put those entities in the exclude_* fields.
-- Example: "Tryndamere 2 without Ashe 3" => units=["Tryndamere 2"], exclude_units=["Ashe 3"]
-- If the user says a unit WITHOUT a specific item (e.g. "Tryndamere without Guinsoo's"), prefer exclude_equipped=[{unit,item}] over exclude_items.
-
-RULES:
-1. Extract EVERY entity - do not miss any
-2. Numbers before/after traits refer to the in-game breakpoint number (e.g., "5 demacia" = Demacia 5)
-3. Numbers near unit names refer to star level (e.g., "Ambessa 2" or "2 star Ambessa" = Ambessa 2★)
-4. Match phonetically similar words to the closest enum value
-5. Always call add_search_filters with everything detected"""
-
-    tool_definition = {
+def _build_tool_definition(vocab: dict) -> dict:
+    """Build the add_search_filters tool schema (enum lists come from the voice vocab)."""
+    return {
         "type": "function",
         "name": "add_search_filters",
         "description": "Add TFT game filters. Use ONLY values from the provided enums.",
@@ -1601,6 +1892,55 @@ RULES:
         }
     }
 
+
+# Cache for the tool schema; rebuilt only when the voice vocab object changes.
+_tool_definition_cache: tuple[dict, dict] | None = None
+
+
+def _get_tool_definition(vocab: dict) -> dict:
+    """Get the cached tool schema for the given vocab."""
+    global _tool_definition_cache
+    cached = _tool_definition_cache
+    if cached is not None and cached[0] is vocab:
+        return cached[1]
+    tool_definition = _build_tool_definition(vocab)
+    _tool_definition_cache = (vocab, tool_definition)
+    return tool_definition
+
+
+def _get_session_update_event():
+    """Build session.update event to configure tools after connection."""
+    vocab = _get_voice_vocab()
+    if not vocab:
+        return None
+
+    instructions = """You are a TFT (Teamfight Tactics) voice command parser for the Smeecher UI. Extract ALL game entities the user mentions AND any UI intent.
+
+ITEM ABBREVIATIONS (expand before calling tool):
+hoj=Hand of Justice, jg=Jeweled Gauntlet, tg=Thief's Gloves, ie=Infinity Edge, bt=Bloodthirster, gs=Giant Slayer, lw=Last Whisper, db=Deathblade, ga=Guardian Angel, qss=Quicksilver, rfc=Rapid Firecannon, rb=Guinsoo's Rageblade, tr=Titan's Resolve, dcap=Rabadon's Deathcap, shiv=Statikk Shiv, shojin=Spear of Shojin, blue=Blue Buff, nashors=Nashor's Tooth, archangels=Archangel's Staff, morello=Morellonomicon, sunfire=Sunfire Cape, ionic=Ionic Spark, shroud=Shroud of Stillness, eon=Edge of Night, gargoyle=Gargoyle Stoneplate, bramble=Bramble Vest, dclaw=Dragon's Claw, warmogs=Warmog's Armor, zzrot=Zz'Rot Portal, hullbreaker=Hullcrusher, cg=Crownguard
+
+UI INTENT (set these fields when the user asks for it):
+- If the user asks for best items/builds (e.g., "best artifacts for ashe"), set open_item_explorer=true.
+- If the user asks for best comp(s)/composition(s)/archetype(s) (e.g., "best yasuo comp"), set open_cluster_explorer=true (and run_cluster_explorer=true).
+- If the user mentions item categories, set item_types to the matching keys: component, full, radiant, artifact, emblem.
+- If the user says "best"/"top", set item_explorer_sort_mode="helpful"; if "worst"/"bad", set "harmful"; if "impact"/"most impact", set "impact"; if "necessary"/"necessity", set "necessity".
+- If the user says "build(s)", set item_explorer_tab="builds"; if they say "item(s)" or mention an item category, set item_explorer_tab="items".
+- If the user says a unit is "with"/"holding"/"equipped with" an item, put that in equipped=[{unit, item}].
+
+EXCLUSION / NEGATION:
+- If the user says "without", "no", "exclude", "not", "minus", or uses similar negation language, put those entities in the exclude_* fields.
+- Example: "Tryndamere 2 without Ashe 3" => units=["Tryndamere 2"], exclude_units=["Ashe 3"]
+- If the user says a unit WITHOUT a specific item (e.g. "Tryndamere without Guinsoo's"), prefer exclude_equipped=[{unit,item}] over exclude_items.
+
+RULES:
+1. Extract EVERY entity - do not miss any
+2. Numbers before/after traits refer to the in-game breakpoint number (e.g., "5 demacia" = Demacia 5)
+3. Numbers near unit names refer to star level (e.g., "Ambessa 2" or "2 star Ambessa" = Ambessa 2★)
+4. Match phonetically similar words to the closest enum value
+5. Always call add_search_filters with everything detected"""
+
+    tool_definition = _get_tool_definition(vocab)
+
     return {
         "type": "session.update",
         "session": {
@@ -1626,10 +1966,6 @@ async def create_realtime_session(request: Request):
     if ENGINE is None:
         raise HTTPException(status_code=503, detail="Engine not loaded")
 
-    session_config = _get_realtime_session_config()
-    if not session_config:
-        raise HTTPException(status_code=503, detail="Vocabulary not loaded")
-
     # Get SDP offer from browser (and reject absurd requests early).
     content_length = request.headers.get("content-length")
     if content_length:
@@ -1646,55 +1982,52 @@ async def create_realtime_session(request: Request):
     if len(raw) > VOICE_MAX_SDP_BYTES:
         raise HTTPException(status_code=413, detail="SDP offer too large")
 
-    try:
-        sdp_offer = raw.decode("utf-8")
-    except UnicodeDecodeError:
-        sdp_offer = raw.decode("utf-8", errors="ignore")
-
     # Quick sanity checks to avoid spending API calls on garbage.
-    if "m=audio" not in sdp_offer or "v=" not in sdp_offer:
+    # SDP is ASCII, so check the raw bytes and forward them without decoding.
+    if b"m=audio" not in raw or b"v=" not in raw:
         raise HTTPException(status_code=400, detail="Invalid SDP offer")
 
     # Guardrail: prevent abusive session creation.
     _enforce_voice_rate_limits(request)
-    reserved_slot = True
 
-    try:
-        async with httpx.AsyncClient() as client:
+    # No await between the busy check above and taking the slot, so this can't block.
+    async with (_voice_semaphore if VOICE_RATE_LIMIT_ENABLED else nullcontext()):
+        try:
+            client: httpx.AsyncClient = request.app.state.http_client
             # Build multipart form data - use files with None filename for text fields
             response = await client.post(
                 "https://api.openai.com/v1/realtime/calls",
                 headers={"Authorization": f"Bearer {OPENAI_API_KEY}"},
                 files={
-                    'sdp': (None, sdp_offer),
-                    'session': (None, json.dumps(session_config)),
+                    'sdp': (None, raw),
+                    'session': (None, _REALTIME_SESSION_CONFIG_JSON),
                 },
                 timeout=10.0,
             )
+        except httpx.RequestError as e:
+            raise HTTPException(status_code=502, detail=f"Failed to connect to OpenAI: {str(e)}")
 
-            if not response.is_success:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=f"OpenAI error: {response.text}"
-                )
+    if not response.is_success:
+        raise HTTPException(
+            status_code=response.status_code,
+            detail=f"OpenAI error: {response.text}"
+        )
 
-            # Return SDP answer to browser
-            return Response(
-                content=response.content,
-                media_type="application/sdp"
-            )
+    # Return SDP answer to browser
+    return Response(
+        content=response.content,
+        media_type="application/sdp"
+    )
 
-    except httpx.RequestError as e:
-        raise HTTPException(status_code=502, detail=f"Failed to connect to OpenAI: {str(e)}")
-    finally:
-        # Make sure we always release the concurrency slot.
-        if reserved_slot:
-            _release_voice_concurrency_slot()
+
+# Pre-serialized /voice-vocab body; rebuilt only when the voice vocab object changes.
+_voice_vocab_json_cache: tuple[dict, bytes] | None = None
 
 
 @app.get("/voice-vocab")
 async def get_voice_vocab():
     """Return vocabulary for client-side token validation."""
+    global _voice_vocab_json_cache
     if ENGINE is None:
         raise HTTPException(status_code=503, detail="Engine not loaded")
 
@@ -1702,28 +2035,46 @@ async def get_voice_vocab():
     if not vocab:
         raise HTTPException(status_code=503, detail="Vocabulary not loaded")
 
-    return {
-        "units": vocab['units'],
-        "items": vocab['items'],
-        "traits": vocab['traits'],
-        "unit_lookup": vocab['unit_lookup'],
-        "item_lookup": vocab['item_lookup'],
-        "trait_lookup": vocab['trait_lookup'],
-        "trait_tier_lookup": vocab.get("trait_tier_lookup") or {},
-    }
+    cached = _voice_vocab_json_cache
+    if cached is None or cached[0] is not vocab:
+        body = orjson.dumps(
+            {
+                "units": vocab['units'],
+                "items": vocab['items'],
+                "traits": vocab['traits'],
+                "unit_lookup": vocab['unit_lookup'],
+                "item_lookup": vocab['item_lookup'],
+                "trait_lookup": vocab['trait_lookup'],
+                "trait_tier_lookup": vocab.get("trait_tier_lookup") or {},
+            }
+        )
+        cached = (vocab, body)
+        _voice_vocab_json_cache = cached
+
+    return Response(content=cached[1], media_type="application/json")
+
+
+# Pre-serialized /voice-session-config body; rebuilt only when the voice vocab object changes.
+_session_update_json_cache: tuple[dict, bytes] | None = None
 
 
 @app.get("/voice-session-config")
 async def get_voice_session_config():
     """Return session.update event for configuring voice session via data channel."""
+    global _session_update_json_cache
     if ENGINE is None:
         raise HTTPException(status_code=503, detail="Engine not loaded")
 
-    config = _get_session_update_event()
-    if not config:
+    vocab = _get_voice_vocab()
+    if not vocab:
         raise HTTPException(status_code=503, detail="Vocabulary not loaded")
 
-    return config
+    cached = _session_update_json_cache
+    if cached is None or cached[0] is not vocab:
+        cached = (vocab, orjson.dumps(_get_session_update_event()))
+        _session_update_json_cache = cached
+
+    return Response(content=cached[1], media_type="application/json")
 
 
 @app.get("/stats")
@@ -1777,11 +2128,19 @@ def get_unit_build(
     if unit_token not in ENGINE.token_to_id:
         raise HTTPException(status_code=404, detail=f"Unit '{unit}' not found")
 
+    # Bind hot-loop lookups once (avoids repeated global + attribute lookups per candidate).
+    token_to_id = ENGINE.token_to_id
+    tokens_map = ENGINE.tokens
+    avg_placement_for_bitmap = ENGINE.avg_placement_for_bitmap
+    id_to_token = ENGINE.id_to_token
+    item_type_by_tokenid = ENGINE.item_type_by_tokenid
+    item_prefix_by_tokenid = ENGINE.item_prefix_by_tokenid
+    item_name_by_tokenid = ENGINE.item_name_by_tokenid
+    equipped_copies_by_tokenid = ENGINE.equipped_copies_by_tokenid
+
     # Get base stats (unit + included filters, minus excluded filters)
     base_tokens = [unit_token] + include_filters
-    base_bitmap = ENGINE.filter_bitmap(base_tokens, exclude_filters)
-    n_base = len(base_bitmap)
-    avg_base = ENGINE.avg_placement_for_bitmap(base_bitmap) if n_base > 0 else 4.5
+    base_bitmap, n_base, avg_base = _filter_bitmap_cached(base_tokens, exclude_filters)
 
     if n_base < min_sample:
         return {
@@ -1819,9 +2178,6 @@ def get_unit_build(
     max_builds = 25
     prior_weight = float(max(25, min(2000, int(n_base * 0.05))))
 
-    # Find all equipped tokens for this unit
-    prefix = f"E:{unit}|"
-    all_equipped = [t for t in ENGINE.id_to_token if t.startswith(prefix)]
 
     # If the user already filtered by equipped items on this unit, treat them as locked
     # and only recommend the remaining slots.
@@ -1863,29 +2219,24 @@ def get_unit_build(
         ]
     else:
         # Candidate items: map base item -> {copies -> token+bitmap}.
+        # Only equipped tokens for this unit that pass the item type/prefix filters.
+        candidate_ids = _filter_equipped_ids(
+            ENGINE.equipped_ids_by_unit.get(unit) or BitMap(), allowed_item_types, allowed_item_prefixes
+        )
         candidates_by_item: dict[str, dict] = {}
-        for eq_token in all_equipped:
-            parsed_eq = parse_token(eq_token)
-            if parsed_eq.get("type") != "equipped":
-                continue
-            item_name = parsed_eq.get("item") or ""
+        for token_id in candidate_ids:
+            eq_token = id_to_token[token_id]
+            item_name = item_name_by_tokenid[token_id]
             if not item_name:
                 continue
-            copies = int(parsed_eq.get("copies") or 1)
+            copies = int(equipped_copies_by_tokenid[token_id])
             if copies < 1 or copies > 3:
                 continue
 
-            cand_type = get_item_type(item_name)
-            if allowed_item_types is not None and cand_type not in allowed_item_types:
-                continue
-            cand_prefix = get_item_prefix(item_name)
-            if cand_prefix and cand_prefix.lower() not in allowed_item_prefixes:
-                continue
+            cand_type = item_type_by_tokenid[token_id]
+            cand_prefix = item_prefix_by_tokenid[token_id]
 
-            token_id = ENGINE.token_to_id.get(eq_token)
-            if token_id is None:
-                continue
-            token_stats = ENGINE.tokens.get(token_id)
+            token_stats = tokens_map.get(token_id)
             if token_stats is None:
                 continue
 
@@ -1910,7 +2261,7 @@ def get_unit_build(
             bm1 = entry["bitmaps"].get(1)
             if not tok1 or bm1 is None:
                 continue
-            n_with = len(base_bitmap & bm1)
+            n_with = base_bitmap.intersection_cardinality(bm1)
             if n_with < min_sample:
                 continue
             pruned[item_name] = entry
@@ -1927,23 +2278,32 @@ def get_unit_build(
                     "num_items": len(base_item_dicts),
                 })
         else:
+            # Integer ids per item so beam states de-dupe on small int tuples instead of name tuples.
+            item_key_ids: dict[str, int] = {
+                item_name: token_to_id[cand["tokens"][1]] for item_name, cand in candidates_by_item.items()
+            }
+            for item_name in effective_locked_counts:
+                item_key_ids.setdefault(item_name, -1 - len(item_key_ids))
+
             # Beam search over item combinations to better capture item interactions than greedy selection.
+            # States are plain tuples: (items, bitmap, n, avg, score, counts, key).
             beam = [
-                {
-                    "items": list(base_item_dicts),
-                    "bitmap": base_bitmap,
-                    "n": n_base,
-                    "avg": avg_base,
-                    "score": _shrink_avg(avg_base, n_base, avg_base, prior_weight),
-                    "counts": dict(effective_locked_counts),
-                }
+                (
+                    list(base_item_dicts),
+                    base_bitmap,
+                    n_base,
+                    avg_base,
+                    _shrink_avg(avg_base, n_base, avg_base, prior_weight),
+                    dict(effective_locked_counts),
+                    tuple(sorted(item_key_ids[it["item"]] for it in base_item_dicts)),
+                )
             ]
 
             for _ in range(remaining_slots):
                 next_states = []
-                for state in beam:
+                for state_items, state_bitmap, _, state_avg, _, state_counts, state_key in beam:
                     for item_name, cand in candidates_by_item.items():
-                        prev = int(state["counts"].get(item_name, 0) or 0)
+                        prev = int(state_counts.get(item_name, 0) or 0)
                         want = prev + 1
                         if want > 3:
                             continue
@@ -1952,71 +2312,77 @@ def get_unit_build(
                         if not tok or bm is None:
                             continue
 
-                        with_bitmap = state["bitmap"] & bm
-                        n_with = len(with_bitmap)
+                        # Count first; only materialize intersections that pass min_sample.
+                        n_with = state_bitmap.intersection_cardinality(bm)
                         if n_with < min_sample:
                             continue
+                        with_bitmap = state_bitmap & bm
 
-                        avg_with = ENGINE.avg_placement_for_bitmap(with_bitmap)
+                        avg_with = avg_placement_for_bitmap(with_bitmap)
                         score_with = _shrink_avg(avg_with, n_with, avg_base, prior_weight)
 
                         item_stats = {
                             "item": item_name,
                             "token": tok,
-                            "delta": round(avg_with - state["avg"], 3),
+                            "delta": round(avg_with - state_avg, 3),
                             "avg_placement": round(avg_with, 3),
                             "n": n_with,
                             "item_type": cand["item_type"],
                             "item_prefix": cand["item_prefix"],
                         }
 
-                        next_counts = dict(state["counts"])
+                        next_counts = dict(state_counts)
                         next_counts[item_name] = want
 
-                        next_states.append({
-                            "items": state["items"] + [item_stats],
-                            "bitmap": with_bitmap,
-                            "n": n_with,
-                            "avg": avg_with,
-                            "score": score_with,
-                            "counts": next_counts,
-                        })
+                        next_states.append(
+                            (
+                                state_items + [item_stats],
+                                with_bitmap,
+                                n_with,
+                                avg_with,
+                                score_with,
+                                next_counts,
+                                tuple(sorted(state_key + (item_key_ids[item_name],))),
+                            )
+                        )
 
                 if not next_states:
                     break
 
                 # Prefer lower (better) shrunk score; then lower raw avg; then higher sample size.
-                next_states.sort(key=lambda s: (s["score"], s["avg"], -s["n"]))
+                # Heapify and pop lazily: only the first beam_width unique states are needed,
+                # so this avoids fully sorting the expansion. The index keeps ties stable.
+                ranked = [(st[4], st[3], -st[2], i) for i, st in enumerate(next_states)]
+                heapq.heapify(ranked)
 
                 # De-dupe by item set and keep a reasonable beam.
                 new_beam = []
                 seen_keys = set()
-                for s in next_states:
-                    key = tuple(sorted(it["item"] for it in s["items"]))
+                while ranked and len(new_beam) < beam_width:
+                    st = next_states[heapq.heappop(ranked)[3]]
+                    key = st[6]
                     if key in seen_keys:
                         continue
                     seen_keys.add(key)
-                    new_beam.append(s)
-                    if len(new_beam) >= beam_width:
-                        break
+                    new_beam.append(st)
                 beam = new_beam
 
             # Convert beam states to builds.
             all_builds = []
-            for state in beam:
-                items_out = [{**item, "slot": i + 1} for i, item in enumerate(state["items"][:slots])]
+            for state_items, _, state_n, state_avg, state_score, _, _ in beam:
+                items_out = [{**item, "slot": i + 1} for i, item in enumerate(state_items[:slots])]
                 if not items_out:
                     continue
 
-                final_avg = float(state["avg"])
-                final_n = int(state["n"])
+                final_avg = float(state_avg)
+                final_n = int(state_n)
                 all_builds.append({
                     "items": items_out,
                     "final_avg": round(final_avg, 3),
                     "final_n": final_n,
                     "total_delta": round(final_avg - avg_base, 3),
                     "num_items": len(items_out),
-                    "_score": float(state["score"]),
+                    "_score": float(state_score),
                 })
 
             # Sort and trim.
@@ -2086,10 +2452,17 @@ def get_unit_items(
     if unit_token not in ENGINE.token_to_id:
         raise HTTPException(status_code=404, detail=f"Unit '{unit}' not found")
 
+    # Bind hot-loop lookups once (avoids repeated global + attribute lookups per candidate).
+    token_to_id = ENGINE.token_to_id
+    tokens_map = ENGINE.tokens
+    avg_placement_for_bitmap = ENGINE.avg_placement_for_bitmap
+    id_to_token = ENGINE.id_to_token
+    item_type_by_tokenid = ENGINE.item_type_by_tokenid
+    item_prefix_by_tokenid = ENGINE.item_prefix_by_tokenid
+
     # Build base set: unit + included filters, minus excluded filters
     base_tokens = [unit_token] + include_filters
-    base_bitmap = ENGINE.filter_bitmap(base_tokens, exclude_filters)
-    n_base = len(base_bitmap)
+    base_bitmap, n_base, _ = _filter_bitmap_cached(base_tokens, exclude_filters)
 
     if n_base == 0:
         return {
@@ -2109,19 +2482,7 @@ def get_unit_items(
             t.startswith(f"U:{unit}:") for t in exclude_filters
         )
         if not has_star_filter:
-            from pyroaring import BitMap
-
-            star2plus_bm = BitMap()
-            for s in range(2, 7):
-                star_tok = f"U:{unit}:{s}"
-                token_id = ENGINE.token_to_id.get(star_tok)
-                if token_id is None:
-                    continue
-                stats = ENGINE.tokens.get(token_id)
-                if stats is None:
-                    continue
-                star2plus_bm |= stats.bitmap
-
+            star2plus_bm = ENGINE.unit_star2plus_bm.get(unit)
             if star2plus_bm:
                 # Match the engine's precomputed cache in the default view (no extra filters),
                 # but allow the decision to adapt to the filtered context when users add tokens.
@@ -2129,10 +2490,7 @@ def get_unit_items(
                     n_all = len(base_bitmap)
                     n_2p = len(base_bitmap & star2plus_bm)
                 else:
-                    unit_stats = ENGINE.tokens.get(ENGINE.token_to_id.get(unit_token))
-                    unit_all_bm = unit_stats.bitmap if unit_stats is not None else base_bitmap
-                    n_all = len(unit_all_bm)
-                    n_2p = len(unit_all_bm & star2plus_bm)
+                    n_all, n_2p = ENGINE.unit_star_counts[unit]
                 if n_all > 0 and n_2p >= 2000 and (n_2p / float(n_all)) >= 0.7:
                     base_bitmap &= star2plus_bm
                     n_base = len(base_bitmap)
@@ -2146,7 +2504,7 @@ def get_unit_items(
                             "scope": scope,
                         }
 
-    avg_base = ENGINE.avg_placement_for_bitmap(base_bitmap)
+    avg_base = avg_placement_for_bitmap(base_bitmap)
 
     def _shrink_avg(avg: float, n: int, prior_mean: float, prior_weight: float) -> float:
         """Empirical-Bayes shrinkage to reduce small-sample noise (lower is better)."""
@@ -2157,24 +2515,24 @@ def get_unit_items(
     # Shrinkage strength scales with min_sample so low-n items don't look extreme.
     prior_weight = float(max(25, min(200, int(min_sample * 2))))
 
-    # Find all equipped tokens for this unit: E:{unit}|*
+    # Equipped tokens for this unit (E:{unit}|*, single-copy only) passing the item type/prefix filters.
     prefix = f"E:{unit}|"
-    equipped_tokens = [t for t in ENGINE.id_to_token if t.startswith(prefix) and parse_token(t).get("copies", 1) == 1]
+    equipped_ids = _filter_equipped_ids(
+        (ENGINE.equipped_ids_by_unit.get(unit) or BitMap()) - ENGINE.equipped_copy_ids,
+        allowed_item_types,
+        allowed_item_prefixes,
+    )
 
     # Track which items are already equipped on this unit in filters (to exclude from recommendations).
     # NOTE: We intentionally do *not* treat global item tokens (I:Item) as "already present",
     # since they refer to the item existing anywhere on the board, not necessarily on this unit.
-    existing_items = set()
-    for t in include_filters:
-        parsed = parse_token(t)
-        if parsed["type"] == "equipped" and parsed["unit"] == unit:
-            existing_items.add(parsed["item"])
+    existing_items = {t[len(prefix):].split(":", 1)[0] for t in include_filters if t.startswith(prefix)}
 
     # Score each equipped token
     results = []
-    for eq_token in equipped_tokens:
-        parsed_eq = parse_token(eq_token)
-        item_name = parsed_eq.get("item")
+    for token_id in equipped_ids:
+        eq_token = id_to_token[token_id]
+        item_name = eq_token[len(prefix):]
         if not item_name:
             continue
 
@@ -2182,27 +2540,22 @@ def get_unit_items(
         if item_name in existing_items:
             continue
 
-        item_type = get_item_type(item_name)
-        if allowed_item_types is not None and item_type not in allowed_item_types:
-            continue
-        item_prefix = get_item_prefix(item_name)
-        if item_prefix and item_prefix.lower() not in allowed_item_prefixes:
-            continue
-
-        token_id = ENGINE.token_to_id.get(eq_token)
-        if token_id is None or token_id not in ENGINE.tokens:
+        if token_id not in tokens_map:
             continue
 
-        token_stats = ENGINE.tokens[token_id]
+        item_type = item_type_by_tokenid[token_id]
+        item_prefix = item_prefix_by_tokenid[token_id]
 
-        # Intersect with base set
-        with_bitmap = base_bitmap & token_stats.bitmap
-        n_with = len(with_bitmap)
+        token_stats = tokens_map[token_id]
 
+        # Count first; only materialize the intersection when it passes min_sample.
+        n_with = base_bitmap.intersection_cardinality(token_stats.bitmap)
         if n_with < min_sample:
             continue
 
-        avg_with = ENGINE.avg_placement_for_bitmap(with_bitmap)
+        with_bitmap = base_bitmap & token_stats.bitmap
+
+        avg_with = avg_placement_for_bitmap(with_bitmap)
         delta_raw = avg_with - avg_base
         avg_adj = _shrink_avg(avg_with, n_with, avg_base, prior_weight)
         delta_adj = avg_adj - avg_base
@@ -2246,64 +2599,22 @@ def get_unit_items(
 
         if use_cache:
             scope_min_star = int(scope.get("unit_stars_min") or 1)
+            cached_rows: list[dict] = []
+            cached_ids: list[int] = []
             for row in results:
                 eq_token = row.get("token")
-                token_id = ENGINE.token_to_id.get(eq_token) if isinstance(eq_token, str) else None
+                token_id = token_to_id.get(eq_token) if isinstance(eq_token, str) else None
                 if token_id is None:
                     row["necessity"] = None
                     continue
-
-                stored_scope = int(ENGINE.necessity_top4_scope_min_star[token_id])
-                if stored_scope and stored_scope != scope_min_star:
-                    row["necessity"] = None
-                    continue
-
-                tau = float(ENGINE.necessity_top4_tau[token_id])
-                if not np.isfinite(tau):
-                    row["necessity"] = None
-                    continue
-
-                ci_low = float(ENGINE.necessity_top4_ci95_low[token_id])
-                ci_high = float(ENGINE.necessity_top4_ci95_high[token_id])
-                se = float(ENGINE.necessity_top4_se[token_id])
-                raw_tau = float(ENGINE.necessity_top4_raw_tau[token_id])
-                frac_trimmed = float(ENGINE.necessity_top4_frac_trimmed[token_id])
-                e_p01 = float(ENGINE.necessity_top4_e_p01[token_id])
-                e_p99 = float(ENGINE.necessity_top4_e_p99[token_id])
-
-                warnings: list[str] = []
-                if np.isfinite(frac_trimmed) and frac_trimmed > 0.5:
-                    warnings.append("Low overlap: large fraction of samples trimmed by propensity bounds.")
-                if np.isfinite(e_p01) and np.isfinite(e_p99) and (e_p01 < 0.02 or e_p99 > 0.98):
-                    warnings.append("Positivity warning: propensity is near 0/1 in parts of X (effect may be unstable).")
-
-                row["necessity"] = {
-                    "method": "aipw",
-                    "outcome": "top4",
-                    "tau": round(tau, 6),
-                    "ci95_low": round(ci_low, 6) if np.isfinite(ci_low) else None,
-                    "ci95_high": round(ci_high, 6) if np.isfinite(ci_high) else None,
-                    "se": round(se, 6) if np.isfinite(se) else None,
-                    "p_value": None,
-                    "raw_tau": round(raw_tau, 6) if np.isfinite(raw_tau) else None,
-                    "n_treated": int(ENGINE.necessity_top4_n_treated[token_id]),
-                    "n_control": int(ENGINE.necessity_top4_n_control[token_id]),
-                    "n_used": int(ENGINE.necessity_top4_n_used[token_id]),
-                    "frac_trimmed": round(frac_trimmed, 6) if np.isfinite(frac_trimmed) else None,
-                    "e_p01": round(e_p01, 6) if np.isfinite(e_p01) else None,
-                    "e_p50": None,
-                    "e_p99": round(e_p99, 6) if np.isfinite(e_p99) else None,
-                    "risk_ratio": None,
-                    "e_value": None,
-                    "warnings": warnings,
-                    "cached": True,
-                    "scope_min_star": stored_scope or scope_min_star,
-                }
+                cached_rows.append(row)
+                cached_ids.append(token_id)
+            for row, nec in zip(cached_rows, _cached_necessity_rows(cached_ids, "top4", scope_min_star)):
+                row["necessity"] = nec
         else:
             # Fast contextual estimate:
             # stratify boards into coarse archetype clusters (units+traits only),
             # then compute a trimmed, cluster-adjusted Top4 difference for each item.
-            from pyroaring import BitMap
 
             max_rows = 80_000
             min_token_freq = max(50, int(min_sample))
@@ -2312,17 +2623,19 @@ def get_unit_items(
             min_group = max(100, int(min_sample))
             min_cluster_group = max(25, int(min_sample))
 
-            base_ids_full = np.array(base_bitmap.to_array(), dtype=np.int64)
+            base_ids_full = np.frombuffer(base_bitmap.to_array(), dtype=np.uint32)
             rng = np.random.default_rng(42)
             if base_ids_full.size > max_rows:
                 sel = rng.choice(base_ids_full.size, size=max_rows, replace=False)
-                base_ids = np.sort(base_ids_full[sel])
+                # base_ids_full is ascending, so sorted positions keep base_ids sorted.
+                sel.sort()
+                base_ids = base_ids_full[sel]
                 base_bitmap_model = BitMap(base_ids)
             else:
                 base_ids = base_ids_full
                 base_bitmap_model = base_bitmap
 
-            placements = ENGINE.placements[base_ids].astype(np.int16, copy=False)
+            placements = ENGINE.placements[base_ids]
             y, kind = placements_to_outcome(placements, necessity_outcome_norm)
 
             feature_tokens = select_feature_tokens(
@@ -2346,8 +2659,6 @@ def get_unit_items(
                 for row in results:
                     row["necessity"] = None
             else:
-                from sklearn.cluster import MiniBatchKMeans
-
                 n_clusters = 8
                 # Keep clusters reasonably populated to reduce noise.
                 n_clusters = min(n_clusters, max(2, int(base_ids.size // 500)))
@@ -2359,11 +2670,15 @@ def get_unit_items(
                     n_init=3,
                     reassignment_ratio=0.01,
                 )
+                # Fit directly on the sparse matrix: rows carry only a few dozen
+                # unit/trait tokens, so sklearn's O(nnz) sparse path beats any
+                # dense low-dimensional sketch of X_tok.
                 labels = kmeans.fit_predict(X_tok).astype(np.int32, copy=False)
 
                 cluster_sizes = np.bincount(labels, minlength=n_clusters).astype(np.int32, copy=False)
                 y_f = y.astype(np.float64, copy=False)
-                y2_f = (y_f * y_f).astype(np.float64, copy=False)
+                # Binary outcomes satisfy y² == y, so skip the square.
+                y2_f = y_f if kind == "binary" else y_f * y_f
                 cluster_y_sum = np.bincount(labels, weights=y_f, minlength=n_clusters).astype(
                     np.float64, copy=False
                 )
@@ -2372,167 +2687,215 @@ def get_unit_items(
                 )
                 n_total = int(base_ids.size)
 
-                # Precompute weighted quantiles of per-cluster treatment rates.
-                def _weighted_quantile(v: np.ndarray, w: np.ndarray, q: float) -> float:
-                    if v.size == 0:
-                        return float("nan")
-                    q = float(q)
-                    q = 0.0 if q < 0 else 1.0 if q > 1 else q
-                    order = np.argsort(v)
-                    v_s = v[order]
-                    w_s = w[order].astype(np.float64, copy=False)
-                    cw = np.cumsum(w_s)
-                    total = float(cw[-1]) if cw.size else 0.0
-                    if total <= 0:
-                        return float("nan")
-                    target = q * total
-                    idx = int(np.searchsorted(cw, target, side="left"))
-                    idx = max(0, min(idx, v_s.size - 1))
-                    return float(v_s[idx])
-
-                def _var_from_sums(n: np.ndarray, s: np.ndarray, s2: np.ndarray) -> np.ndarray:
-                    n_f = n.astype(np.float64, copy=False)
-                    mu = s / np.maximum(n_f, 1.0)
-                    denom = np.maximum(n_f - 1.0, 1.0)
-                    var = (s2 - n_f * (mu * mu)) / denom
-                    return np.clip(var, 0.0, None)
-
-                # Iterate items and compute a trimmed, cluster-adjusted estimate.
+                # Weighted quantiles of per-cluster treatment rates, one row per item.
+                def _weighted_quantiles(v: np.ndarray, w: np.ndarray, qs: np.ndarray) -> np.ndarray:
+                    """Quantiles `qs` of each row of `v` under shared weights `w`; sorts once per row."""
+                    out = np.full((v.shape[0], qs.size), np.nan, dtype=np.float64)
+                    if v.shape[1] == 0:
+                        return out
+                    qs = np.clip(qs.astype(np.float64, copy=False), 0.0, 1.0)
+                    order = np.argsort(v, axis=1)
+                    v_s = np.take_along_axis(v, order, axis=1)
+                    cw = np.cumsum(w.astype(np.float64, copy=False)[order], axis=1)
+                    total = cw[:, -1]
+                    targets = qs[None, :] * total[:, None]
+                    # searchsorted(side="left") per row == count of cw strictly below target.
+                    idx = (cw[:, None, :] < targets[:, :, None]).sum(axis=2)
+                    idx = np.minimum(idx, v.shape[1] - 1)
+                    vals = np.take_along_axis(v_s, idx, axis=1)
+                    ok = total > 0
+                    out[ok] = vals[ok]
+                    return out
+
+                def _cluster_stats(
+                    treated_counts: np.ndarray, treated_y_sum: np.ndarray, treated_y2_sum: np.ndarray
+                ) -> tuple[np.ndarray, ...]:
+                    """
+                    Overlap-trimmed stratified estimate for a batch of items.
+
+                    Inputs are (n_items, n_clusters) tallies; returns propensity `e`, the
+                    used-cluster mask, per-item used counts, tau and var(tau). Every op
+                    spans all items, so the tiny cluster axis (<= 8) never drives a loop.
+                    """
+                    control_counts = cluster_sizes - treated_counts
+                    control_y_sum = cluster_y_sum - treated_y_sum
+                    control_y2_sum = cluster_y2_sum - treated_y2_sum
+
+                    e = treated_counts / np.maximum(cluster_sizes, 1).astype(np.float64)
+                    used = (
+                        (cluster_sizes >= (min_cluster_group * 2))
+                        & (treated_counts >= min_cluster_group)
+                        & (control_counts >= min_cluster_group)
+                        & (e >= overlap_min)
+                        & (e <= overlap_max)
+                    )
+
+                    weights = np.where(used, cluster_sizes, 0).astype(np.float64)
+                    n_used = weights.sum(axis=1).astype(np.int64)
+                    n_treated_used = np.sum(treated_counts, axis=1, where=used)
+                    n_control_used = np.sum(control_counts, axis=1, where=used)
+
+                    with np.errstate(divide="ignore", invalid="ignore"):
+                        mu1 = treated_y_sum / treated_counts
+                        mu0 = control_y_sum / control_counts
+                        tau = np.sum((mu1 - mu0) * weights, axis=1, where=used) / weights.sum(axis=1)
+
+                        # Approx SE for weighted stratified difference in means. Used
+                        # clusters have both arms populated, so the arm means above need no
+                        # guard and the sample variance is (s2 - s*mu) / (n - 1).
+                        var1 = np.clip((treated_y2_sum - treated_y_sum * mu1) / np.maximum(treated_counts - 1.0, 1.0), 0.0, None)
+                        var0 = np.clip((control_y2_sum - control_y_sum * mu0) / np.maximum(control_counts - 1.0, 1.0), 0.0, None)
+                        var_diff = var1 / treated_counts + var0 / control_counts
+                        w = weights / np.maximum(n_used, 1).astype(np.float64)[:, None]
+                        var_tau = np.sum((w**2) * var_diff, axis=1, where=used)
+
+                    return e, used, n_used, n_treated_used, n_control_used, tau, var_tau
+
+                # First pass: resolve tokens and apply cardinality bounds; row
+                # mapping, raw deltas and cluster tallies run batched below.
+                y_total = float(cluster_y_sum.sum())
+                min_arm = max(min_group, 50)
+                pending: list[tuple[dict, int, int]] = []
+                pending_ids: list[np.ndarray] = []
                 for row in results:
                     eq_token = row.get("token")
-                    token_id = ENGINE.token_to_id.get(eq_token) if isinstance(eq_token, str) else None
-                    token_stats = ENGINE.tokens.get(token_id) if token_id is not None else None
+                    token_id = token_to_id.get(eq_token) if isinstance(eq_token, str) else None
+                    token_stats = tokens_map.get(token_id) if token_id is not None else None
                     if token_stats is None:
                         row["necessity"] = None
                         continue
 
-                    treated_bm = base_bitmap_model & token_stats.bitmap
-                    treated_ids = np.array(treated_bm.to_array(), dtype=np.int64)
-                    T_rows = np.searchsorted(base_ids, treated_ids).astype(np.int32, copy=False) if treated_ids.size else np.zeros((0,), dtype=np.int32)
-
-                    n_treated = int(T_rows.size)
+                    # Cheap bounds first: each arm needs min_arm rows, and the
+                    # used-cluster arms below can never exceed the raw arm sizes.
+                    if token_stats.count < min_arm:
+                        row["necessity"] = None
+                        continue
+                    n_treated = int(base_bitmap_model.intersection_cardinality(token_stats.bitmap))
                     n_control = int(n_total - n_treated)
-                    if n_treated < min_group or n_control < min_group:
+                    if n_treated < min_arm or n_control < min_arm:
                         row["necessity"] = None
                         continue
 
-                    # Raw (unadjusted) outcome delta.
-                    y_t = y[T_rows] if T_rows.size else np.zeros((0,), dtype=y.dtype)
-                    y1_mean = float(y_t.mean()) if y_t.size else float("nan")
-                    y0_mean = float(((y.sum() - y_t.sum()) / max(1, n_control)))
-                    raw_tau = float(y1_mean - y0_mean) if np.isfinite(y1_mean) and np.isfinite(y0_mean) else float("nan")
-
-                    treated_labels = labels[T_rows] if T_rows.size else np.zeros((0,), dtype=np.int32)
-                    treated_counts = np.bincount(treated_labels, minlength=n_clusters).astype(np.int32, copy=False)
-                    treated_y = y_f[T_rows] if T_rows.size else np.zeros((0,), dtype=np.float64)
-                    treated_y_sum = np.bincount(treated_labels, weights=treated_y, minlength=n_clusters).astype(
-                        np.float64, copy=False
-                    )
-                    treated_y2_sum = np.bincount(treated_labels, weights=(treated_y * treated_y), minlength=n_clusters).astype(
-                        np.float64, copy=False
+                    pending.append((row, n_treated, n_control))
+                    pending_ids.append(np.frombuffer(token_stats.bitmap.to_array(), dtype=np.uint32))
+
+                if pending:
+                    # Locate every item's ids among base rows in one sorted lookup;
+                    # hits per item equal its n_treated, so they lay out T's rows.
+                    n_items = len(pending)
+                    n_treated_arr = np.array([p[1] for p in pending], dtype=np.int64)
+                    n_control_arr = n_total - n_treated_arr
+                    token_ids = np.concatenate(pending_ids)
+                    pos = np.searchsorted(base_ids, token_ids)
+                    indices = pos[base_ids[np.minimum(pos, n_total - 1)] == token_ids].astype(np.int32, copy=False)
+                    indptr = np.zeros((n_items + 1,), dtype=np.int64)
+                    np.cumsum(n_treated_arr, out=indptr[1:])
+
+                    # Treatment matrix T (items x rows) against one-hot cluster
+                    # membership yields per-item, per-cluster tallies.
+                    T = csr_matrix(
+                        (np.ones((indices.size,), dtype=np.float64), indices, indptr),
+                        shape=(n_items, n_total),
                     )
 
-                    control_counts = (cluster_sizes - treated_counts).astype(np.int32, copy=False)
-                    control_y_sum = (cluster_y_sum - treated_y_sum).astype(np.float64, copy=False)
-                    control_y2_sum = (cluster_y2_sum - treated_y2_sum).astype(np.float64, copy=False)
+                    # Row r of W holds (1, y, y²) at columns (c, k + c, 2k + c) for its
+                    # cluster c, so a single SpMM yields all three tallies per item.
+                    k = n_clusters
+                    W = csr_matrix(
+                        (
+                            np.column_stack([np.ones((n_total,), dtype=np.float64), y_f, y2_f]).ravel(),
+                            np.column_stack([labels, labels + k, labels + 2 * k]).ravel(),
+                            np.arange(0, 3 * n_total + 1, 3, dtype=np.int64),
+                        ),
+                        shape=(n_total, 3 * k),
+                    )
+                    tallies = (T @ W).toarray()
+                    treated_counts = np.rint(tallies[:, :k]).astype(np.int64, copy=False)
+                    treated_y_sum = tallies[:, k : 2 * k]
+                    treated_y2_sum = tallies[:, 2 * k :]
 
-                    with np.errstate(divide="ignore", invalid="ignore"):
-                        e = treated_counts.astype(np.float64) / np.maximum(cluster_sizes.astype(np.float64), 1.0)
+                    # Raw (unadjusted) outcome delta, reusing the per-cluster y tallies.
+                    y_t_sum = treated_y_sum.sum(axis=1)
+                    raw_tau_all = (y_t_sum / n_treated_arr) - ((y_total - y_t_sum) / np.maximum(n_control_arr, 1))
 
-                    used_clusters = (
-                        (cluster_sizes >= (min_cluster_group * 2))
-                        & (treated_counts >= min_cluster_group)
-                        & (control_counts >= min_cluster_group)
-                        & (e >= overlap_min)
-                        & (e <= overlap_max)
+                    e, used, n_used_all, n_treated_used_all, n_control_used_all, tau_all, var_tau_all = _cluster_stats(
+                        treated_counts, treated_y_sum, treated_y2_sum
                     )
 
-                    n_used = int(cluster_sizes[used_clusters].sum())
-                    n_treated_used = int(treated_counts[used_clusters].sum())
-                    n_control_used = int(control_counts[used_clusters].sum())
-                    if n_used < max(200, int(0.05 * n_total)) or n_treated_used < 50 or n_control_used < 50:
-                        row["necessity"] = None
-                        continue
+                    e_mask = cluster_sizes > 0
+                    e_quantiles = _weighted_quantiles(e[:, e_mask], cluster_sizes[e_mask], np.array([0.01, 0.99]))
+                    min_used = max(200, int(0.05 * n_total))
 
-                    mu1 = treated_y_sum[used_clusters] / treated_counts[used_clusters]
-                    mu0 = control_y_sum[used_clusters] / control_counts[used_clusters]
-                    diffs = mu1 - mu0
-                    weights = cluster_sizes[used_clusters].astype(np.float64, copy=False)
-                    tau = float(np.average(diffs, weights=weights)) if weights.size else float("nan")
-
-                    # Approx SE for weighted stratified difference in means.
-                    var1 = _var_from_sums(
-                        treated_counts[used_clusters],
-                        treated_y_sum[used_clusters],
-                        treated_y2_sum[used_clusters],
-                    )
-                    var0 = _var_from_sums(
-                        control_counts[used_clusters],
-                        control_y_sum[used_clusters],
-                        control_y2_sum[used_clusters],
-                    )
-                    var_diff = (var1 / treated_counts[used_clusters]) + (var0 / control_counts[used_clusters])
-                    w = weights / float(n_used) if n_used > 0 else np.zeros_like(weights)
-                    var_tau = float(np.sum((w**2) * var_diff)) if weights.size else float("nan")
-                    se = float(np.sqrt(var_tau)) if var_tau >= 0 and np.isfinite(var_tau) else float("nan")
-
-                    frac_trimmed = float(1.0 - (n_used / float(n_total))) if n_total else 1.0
-
-                    e_used = e[cluster_sizes > 0]
-                    w_used = cluster_sizes[cluster_sizes > 0]
-                    e_p01 = _weighted_quantile(e_used, w_used, 0.01)
-                    e_p99 = _weighted_quantile(e_used, w_used, 0.99)
-
-                    warnings: list[str] = []
-                    if np.isfinite(frac_trimmed) and frac_trimmed > 0.5:
-                        warnings.append("Low overlap: large fraction of samples trimmed by propensity bounds.")
-                    if np.isfinite(e_p01) and np.isfinite(e_p99) and (e_p01 < 0.02 or e_p99 > 0.98):
-                        warnings.append("Positivity warning: propensity is near 0/1 in parts of X (effect may be unstable).")
-
-                    row["necessity"] = {
-                        "method": "cluster_adjusted",
-                        "outcome": necessity_outcome_norm or "top4",
-                        "tau": round(tau, 6) if np.isfinite(tau) else None,
-                        "ci95_low": round(tau - 1.96 * se, 6) if np.isfinite(tau) and np.isfinite(se) else None,
-                        "ci95_high": round(tau + 1.96 * se, 6) if np.isfinite(tau) and np.isfinite(se) else None,
-                        "se": round(se, 6) if np.isfinite(se) else None,
-                        "p_value": None,
-                        "raw_tau": round(raw_tau, 6) if np.isfinite(raw_tau) else None,
-                        "n_treated": int(n_treated),
-                        "n_control": int(n_control),
-                        "n_used": int(n_used),
-                        "frac_trimmed": round(frac_trimmed, 6) if np.isfinite(frac_trimmed) else None,
-                        "e_p01": round(e_p01, 6) if np.isfinite(e_p01) else None,
-                        "e_p50": None,
-                        "e_p99": round(e_p99, 6) if np.isfinite(e_p99) else None,
-                        "risk_ratio": None,
-                        "e_value": None,
-                        "warnings": warnings,
-                        "cached": False,
-                        "scope_min_star": int(scope.get("unit_stars_min") or 1),
-                    }
+                    for i, (row, n_treated, n_control) in enumerate(pending):
+                        raw_tau = float(raw_tau_all[i])
+                        n_used = int(n_used_all[i])
+                        if n_used < min_used or int(n_treated_used_all[i]) < 50 or int(n_control_used_all[i]) < 50:
+                            row["necessity"] = None
+                            continue
 
-        def _sort_key(x: dict) -> tuple:
+                        tau = float(tau_all[i])
+                        var_tau = float(var_tau_all[i])
+                        se = float(np.sqrt(var_tau)) if var_tau >= 0 and np.isfinite(var_tau) else float("nan")
+
+                        frac_trimmed = float(1.0 - (n_used / float(n_total))) if n_total else 1.0
+
+                        e_p01 = float(e_quantiles[i, 0])
+                        e_p99 = float(e_quantiles[i, 1])
+
+                        warnings: list[str] = []
+                        if np.isfinite(frac_trimmed) and frac_trimmed > 0.5:
+                            warnings.append("Low overlap: large fraction of samples trimmed by propensity bounds.")
+                        if np.isfinite(e_p01) and np.isfinite(e_p99) and (e_p01 < 0.02 or e_p99 > 0.98):
+                            warnings.append("Positivity warning: propensity is near 0/1 in parts of X (effect may be unstable).")
+
+                        row["necessity"] = {
+                            "method": "cluster_adjusted",
+                            "outcome": necessity_outcome_norm or "top4",
+                            "tau": round(tau, 6) if np.isfinite(tau) else None,
+                            "ci95_low": round(tau - 1.96 * se, 6) if np.isfinite(tau) and np.isfinite(se) else None,
+                            "ci95_high": round(tau + 1.96 * se, 6) if np.isfinite(tau) and np.isfinite(se) else None,
+                            "se": round(se, 6) if np.isfinite(se) else None,
+                            "p_value": None,
+                            "raw_tau": round(raw_tau, 6) if np.isfinite(raw_tau) else None,
+                            "n_treated": int(n_treated),
+                            "n_control": int(n_control),
+                            "n_used": int(n_used),
+                            "frac_trimmed": round(frac_trimmed, 6) if np.isfinite(frac_trimmed) else None,
+                            "e_p01": round(e_p01, 6) if np.isfinite(e_p01) else None,
+                            "e_p50": None,
+                            "e_p99": round(e_p99, 6) if np.isfinite(e_p99) else None,
+                            "risk_ratio": None,
+                            "e_value": None,
+                            "warnings": warnings,
+                            "cached": False,
+                            "scope_min_star": int(scope.get("unit_stars_min") or 1),
+                        }
+
+        # Gather sort fields once, then order with a single stable lexsort.
+        n_results = len(results)
+        has_tau = np.zeros((n_results,), dtype=bool)
+        tau_arr = np.zeros((n_results,), dtype=np.float64)
+        frac_arr = np.ones((n_results,), dtype=np.float64)
+        n_used_arr = np.zeros((n_results,), dtype=np.int64)
+        direction_arr = np.ones((n_results,), dtype=np.float64)
+        for i, x in enumerate(results):
             nec = x.get("necessity") or {}
             tau = nec.get("tau")
             if tau is None:
-                return (1, 0.0, 1.0, 0)
-            frac_trimmed = float(nec.get("frac_trimmed") or 1.0)
-            overlap_weight = max(0.0, 1.0 - frac_trimmed)
-            # Prefer large effects that also have decent overlap; heavily penalize
-            # estimates that rely on a narrow sliver of the data.
-            higher_is_better = str(nec.get("outcome") or "").strip().lower() not in ("placement", "expected_placement")
-            direction = 1.0 if higher_is_better else -1.0
-            score = direction * float(tau) * (overlap_weight**2)
-            return (
-                0,
-                -score,
-                -(direction * float(tau)),
-                frac_trimmed,
-                -int(nec.get("n_used") or 0),
-            )
-
-        results.sort(key=_sort_key)
+                continue
+            has_tau[i] = True
+            tau_arr[i] = float(tau)
+            frac_arr[i] = float(nec.get("frac_trimmed") or 1.0)
+            n_used_arr[i] = int(nec.get("n_used") or 0)
+            if str(nec.get("outcome") or "").strip().lower() in ("placement", "expected_placement"):
+                direction_arr[i] = -1.0
+
+        # Prefer large effects that also have decent overlap; heavily penalize
+        # estimates that rely on a narrow sliver of the data.
+        signed_tau = direction_arr * tau_arr
+        score = signed_tau * np.maximum(0.0, 1.0 - frac_arr) ** 2
+        order = np.lexsort((-n_used_arr, frac_arr, -signed_tau, -score, ~has_tau))
+        results = [results[i] for i in order]
     else:
         # Impact: absolute delta, most impactful first
         results.sort(key=lambda x: abs(x["delta"]), reverse=True)
@@ -2592,8 +2955,7 @@ def get_item_units(
 
     # Base set: item present (any holder) + included filters, minus excluded filters.
     base_tokens = [item_token] + include_filters
-    base_bitmap = ENGINE.filter_bitmap(base_tokens, exclude_filters)
-    n_base = int(len(base_bitmap))
+    base_bitmap, n_base, avg_base = _filter_bitmap_cached(base_tokens, exclude_filters)
     if n_base == 0:
         return {
             "item": item,
@@ -2601,50 +2963,50 @@ def get_item_units(
             "base": {"n": 0, "avg_placement": 4.5},
             "units": [],
         }
-    avg_base = ENGINE.avg_placement_for_bitmap(base_bitmap)
-
-    def _shrink_avg(avg: float, n: int, prior_mean: float, prior_weight: float) -> float:
-        """Empirical-Bayes shrinkage to reduce small-sample noise (lower is better)."""
-        if n <= 0:
-            return prior_mean
-        return (avg * n + prior_mean * prior_weight) / (n + prior_weight)
 
     # Shrinkage strength scales with min_sample so low-n holders don't look extreme.
     prior_weight = float(max(25, min(200, int(min_sample * 2))))
 
-    # Consider only base unit tokens (exclude star-level U:Unit:2 etc).
-    unit_tokens = [t for t in ENGINE.get_all_tokens_by_type("U:") if ":" not in t[2:]]
-
-    results: list[dict] = []
-    for unit_token in unit_tokens:
-        unit = unit_token[2:]
-        eq_token = f"E:{unit}|{item}"
-        token_id = ENGINE.token_to_id.get(eq_token)
-        if token_id is None:
-            continue
-        token_stats = ENGINE.tokens.get(token_id)
+    # Walk only the units that actually hold this item (single-copy E:{unit}|{item}).
+    tokens_map = ENGINE.tokens
+    holders: list[tuple[str, str]] = []
+    n_with_list: list[int] = []
+    avg_with_list: list[float] = []
+    for unit, eq_token, token_id in ENGINE.equipped_holders_by_item.get(item, ()):
+        token_stats = tokens_map.get(token_id)
         if token_stats is None:
             continue
 
-        with_bitmap = base_bitmap & token_stats.bitmap
-        n_with = int(len(with_bitmap))
+        # Count first; only materialize the intersection for holders that qualify.
+        n_with = int(base_bitmap.intersection_cardinality(token_stats.bitmap))
         if n_with < int(min_sample):
             continue
 
-        avg_with = ENGINE.avg_placement_for_bitmap(with_bitmap)
-        delta_raw = float(avg_with - avg_base)
-        avg_adj = float(_shrink_avg(avg_with, n_with, avg_base, prior_weight))
-        delta_adj = float(avg_adj - avg_base)
+        holders.append((unit, eq_token))
+        n_with_list.append(n_with)
+        avg_with_list.append(ENGINE.avg_placement_for_bitmap(base_bitmap & token_stats.bitmap))
+
+    # Empirical-Bayes shrinkage toward the item baseline for all holders at once
+    # (reduces small-sample noise; lower is better).
+    n_with_arr = np.array(n_with_list, dtype=np.float64)
+    avg_with_arr = np.array(avg_with_list, dtype=np.float64)
+    avg_adj_arr = np.where(
+        n_with_arr > 0,
+        (avg_with_arr * n_with_arr + avg_base * prior_weight) / (n_with_arr + prior_weight),
+        avg_base,
+    )
 
+    results: list[dict] = []
+    for (unit, eq_token), n_with, avg_with, avg_adj in zip(holders, n_with_list, avg_with_list, avg_adj_arr.tolist()):
         results.append(
             {
                 "unit": unit,
                 "token": eq_token,
-                "delta": round(delta_adj, 3),
+                "delta": round(avg_adj - avg_base, 3),
                 "avg_placement": round(avg_adj, 3),
                 "n": n_with,
                 "pct_of_base": round(n_with / float(n_base) * 100.0, 1) if n_base > 0 else 0,
-                "raw_delta": round(delta_raw, 3),
+                "raw_delta": round(avg_with - avg_base, 3),
                 "raw_avg_placement": round(float(avg_with), 3),
             }
         )
@@ -2662,55 +3024,18 @@ def get_item_units(
         use_cache = bool(getattr(ENGINE, "necessity_top4_ready", False))
 
         if use_cache:
+            cached_rows: list[dict] = []
+            cached_ids: list[int] = []
             for row in results:
                 eq_token = row.get("token")
                 token_id = ENGINE.token_to_id.get(eq_token) if isinstance(eq_token, str) else None
                 if token_id is None:
                     row["necessity"] = None
                     continue
-
-                tau = float(ENGINE.necessity_top4_tau[token_id])
-                if not np.isfinite(tau):
-                    row["necessity"] = None
-                    continue
-
-                ci_low = float(ENGINE.necessity_top4_ci95_low[token_id])
-                ci_high = float(ENGINE.necessity_top4_ci95_high[token_id])
-                se = float(ENGINE.necessity_top4_se[token_id])
-                raw_tau = float(ENGINE.necessity_top4_raw_tau[token_id])
-                frac_trimmed = float(ENGINE.necessity_top4_frac_trimmed[token_id])
-                e_p01 = float(ENGINE.necessity_top4_e_p01[token_id])
-                e_p99 = float(ENGINE.necessity_top4_e_p99[token_id])
-                scope_min_star = int(ENGINE.necessity_top4_scope_min_star[token_id] or 1)
-
-                warnings: list[str] = []
-                if np.isfinite(frac_trimmed) and frac_trimmed > 0.5:
-                    warnings.append("Low overlap: large fraction of samples trimmed by propensity bounds.")
-                if np.isfinite(e_p01) and np.isfinite(e_p99) and (e_p01 < 0.02 or e_p99 > 0.98):
-                    warnings.append("Positivity warning: propensity is near 0/1 in parts of X (effect may be unstable).")
-
-                row["necessity"] = {
-                    "method": "aipw",
-                    "outcome": necessity_outcome,
-                    "tau": round(tau, 6),
-                    "ci95_low": round(ci_low, 6) if np.isfinite(ci_low) else None,
-                    "ci95_high": round(ci_high, 6) if np.isfinite(ci_high) else None,
-                    "se": round(se, 6) if np.isfinite(se) else None,
-                    "p_value": None,
-                    "raw_tau": round(raw_tau, 6) if np.isfinite(raw_tau) else None,
-                    "n_treated": int(ENGINE.necessity_top4_n_treated[token_id]),
-                    "n_control": int(ENGINE.necessity_top4_n_control[token_id]),
-                    "n_used": int(ENGINE.necessity_top4_n_used[token_id]),
-                    "frac_trimmed": round(frac_trimmed, 6) if np.isfinite(frac_trimmed) else None,
-                    "e_p01": round(e_p01, 6) if np.isfinite(e_p01) else None,
-                    "e_p50": None,
-                    "e_p99": round(e_p99, 6) if np.isfinite(e_p99) else None,
-                    "risk_ratio": None,
-                    "e_value": None,
-                    "warnings": warnings,
-                    "cached": True,
-                    "scope_min_star": scope_min_star,
-                }
+                cached_rows.append(row)
+                cached_ids.append(token_id)
+            for row, nec in zip(cached_rows, _cached_necessity_rows(cached_ids, necessity_outcome)):
+                row["necessity"] = nec
 
         def _sort_key(x: dict) -> tuple:
             nec = x.get("necessity") or {}
@@ -2770,6 +3095,148 @@ def get_item_necessity(
     if ENGINE is None:
         raise HTTPException(status_code=503, detail="Engine not loaded")
 
+    params = (
+        unit_stars_min,
+        auto_unit_stars_min,
+        n_splits,
+        max_rows,
+        min_token_freq,
+        overlap_min,
+        overlap_max,
+        by_cluster,
+        n_clusters,
+    )
+    key = (unit, item, tuple(t.strip() for t in tokens.split(",") if t.strip()), outcome, params)
+    now = time.time()
+    with _ITEM_NECESSITY_LOCK:
+        entry = _ITEM_NECESSITY_CACHE.get(key)
+        if entry is not None:
+            ts, result = entry
+            if (now - ts) <= _ITEM_NECESSITY_CACHE_TTL_S:
+                _ITEM_NECESSITY_CACHE.move_to_end(key, last=True)
+                return result
+            _ITEM_NECESSITY_CACHE.pop(key, None)
+
+    result = _estimate_item_necessity(unit, item, tokens, outcome, *params)
+
+    with _ITEM_NECESSITY_LOCK:
+        _ITEM_NECESSITY_CACHE[key] = (now, result)
+        _ITEM_NECESSITY_CACHE.move_to_end(key, last=True)
+        while len(_ITEM_NECESSITY_CACHE) > _ITEM_NECESSITY_CACHE_MAX:
+            _ITEM_NECESSITY_CACHE.popitem(last=False)
+    return result
+
+
+def _item_necessity_token_matrix(
+    unit_token: str,
+    base_bitmap: BitMap,
+    base_ids: np.ndarray,
+    min_token_freq: int,
+) -> tuple[csr_matrix, list[str], np.ndarray]:
+    """
+    Return the (cached) unit/trait token-presence matrix for /item-necessity.
+
+    Only U:/T: tokens are used, so the item-specific exclusions (E:/I:) never match and
+    the result depends only on the unit, the base rows and min_token_freq. Cached
+    matrices are shared between requests and must be treated as read-only.
+    """
+    digest = hashlib.blake2b(base_ids.tobytes(), digest_size=16).digest()
+    key = (unit_token, int(min_token_freq), int(base_ids.size), digest)
+    now = time.time()
+    with _TOKEN_MATRIX_LOCK:
+        entry = _TOKEN_MATRIX_CACHE.get(key)
+        if entry is not None:
+            ts, X_tok, kept, base_counts = entry
+            if (now - ts) <= _TOKEN_MATRIX_CACHE_TTL_S:
+                _TOKEN_MATRIX_CACHE.move_to_end(key, last=True)
+                return X_tok, kept, base_counts
+            _TOKEN_MATRIX_CACHE.pop(key, None)
+
+    feature_params = TokenFeatureParams(
+        use_units=True,
+        use_traits=True,
+        use_items=False,
+        use_equipped=False,
+        include_star_units=False,
+        include_tier_traits=True,
+        min_token_freq=min_token_freq,
+    )
+    feature_tokens = select_feature_tokens(ENGINE, feature_params, exclude={unit_token})
+    X_tok, kept, base_counts, _feature_rows = build_sparse_feature_matrix(ENGINE, base_bitmap, base_ids, feature_tokens)
+
+    with _TOKEN_MATRIX_LOCK:
+        _TOKEN_MATRIX_CACHE[key] = (now, X_tok, kept, base_counts)
+        _TOKEN_MATRIX_CACHE.move_to_end(key, last=True)
+        while len(_TOKEN_MATRIX_CACHE) > _TOKEN_MATRIX_CACHE_MAX:
+            _TOKEN_MATRIX_CACHE.popitem(last=False)
+    return X_tok, kept, base_counts
+
+
+# (n_splits, max_rows, min_token_freq, overlap_min, overlap_max) the top4 necessity
+# cache was precomputed with; only requests with exactly these knobs can reuse it.
+_NECESSITY_TOP4_DEFAULTS = (2, 80_000, 25, 0.05, 0.95)
+
+
+def _fast_necessity_top4(
+    unit: str,
+    item: str,
+    eq_token: str,
+    filter_tokens: list[str],
+    scope: dict,
+    n_base: int,
+    n_treated: int,
+    n_control: int,
+    base_rates: dict[str, float],
+    treated_rates: dict[str, float],
+    control_rates: dict[str, float],
+) -> dict | None:
+    """Build the /item-necessity response from the top4 cache, or None when it does not apply."""
+    if not getattr(ENGINE, "necessity_top4_ready", False):
+        return None
+    tok_id = ENGINE.token_to_id.get(eq_token)
+    payload = _necessity_top4_payload(tok_id) if tok_id is not None else None
+    if payload is None:
+        return None
+    effect, overlap, cached_warnings, stored_scope = payload
+    if stored_scope != int(scope.get("unit_stars_min") or 1):
+        return None
+    return {
+        "unit": unit,
+        "item": item,
+        "filters": filter_tokens,
+        "scope": scope,
+        "base": {"n": int(n_base), **{k: round(v, 6) for k, v in base_rates.items()}},
+        "treatment": {
+            "token": eq_token,
+            "n_treated": int(n_treated),
+            "n_control": int(n_control),
+            "treated": {k: round(v, 6) for k, v in treated_rates.items()},
+            "control": {k: round(v, 6) for k, v in control_rates.items()},
+        },
+        "effect": dict(effect),
+        "overlap": {**overlap, "bounds": [_NECESSITY_TOP4_DEFAULTS[3], _NECESSITY_TOP4_DEFAULTS[4]]},
+        "warning": None,
+        "warnings": list(cached_warnings),
+        "cached": True,
+    }
+
+
+def _estimate_item_necessity(
+    unit: str,
+    item: str,
+    tokens: str,
+    outcome: str,
+    unit_stars_min: int,
+    auto_unit_stars_min: bool,
+    n_splits: int,
+    max_rows: int,
+    min_token_freq: int,
+    overlap_min: float,
+    overlap_max: float,
+    by_cluster: bool,
+    n_clusters: int,
+) -> dict:
+    """Uncached body of /item-necessity; see get_item_necessity for the parameters."""
     # Parse additional filter tokens (supports exclude tokens prefixed by '-' or '!')
     filter_tokens = [t.strip() for t in tokens.split(",") if t.strip()]
     include_filters: list[str] = []
@@ -2784,7 +3251,6 @@ def get_item_necessity(
 
     unit_token = f"U:{unit}"
     eq_token = f"E:{unit}|{item}"
-    item_token = f"I:{item}"
 
     if unit_token not in ENGINE.token_to_id:
         raise HTTPException(status_code=404, detail=f"Unit '{unit}' not found")
@@ -2793,14 +3259,12 @@ def get_item_necessity(
 
     # Base set: unit + included filters, minus excluded filters
     base_tokens = [unit_token] + include_filters
-    base_bitmap = ENGINE.filter_bitmap(base_tokens, exclude_filters)
+    base_bitmap, _, _ = _filter_bitmap_cached(base_tokens, exclude_filters)
     scope = {"unit_stars_min": unit_stars_min, "auto": False}
     has_star_filter = any(t.startswith(f"U:{unit}:") for t in include_filters) or any(
         t.startswith(f"U:{unit}:") for t in exclude_filters
     )
     if auto_unit_stars_min and not has_star_filter and unit_stars_min == 1:
-        from pyroaring import BitMap
-
         star2plus_bm = BitMap()
         for s in range(2, 7):
             star_tok = f"U:{unit}:{s}"
@@ -2819,8 +3283,6 @@ def get_item_necessity(
                 scope = {"unit_stars_min": unit_stars_min, "auto": True}
 
     if unit_stars_min >= 2:
-        from pyroaring import BitMap
-
         stars_bm = BitMap()
         for s in range(unit_stars_min, 7):
             star_tok = f"U:{unit}:{s}"
@@ -2864,18 +3326,20 @@ def get_item_necessity(
             "warning": "Insufficient overlap/sample size for a reliable causal estimate.",
         }
 
-    base_ids_full = np.array(base_bitmap.to_array(), dtype=np.int64)
-    treated_ids = np.array(treated_bm.to_array(), dtype=np.int64)
+    base_ids_full = np.frombuffer(base_bitmap.to_array(), dtype=np.uint32)
+    treated_ids = np.frombuffer(treated_bm.to_array(), dtype=np.uint32)
     T_full = np.zeros((base_ids_full.size,), dtype=np.int8)
     if treated_ids.size:
-        rows = np.searchsorted(base_ids_full, treated_ids).astype(np.int64, copy=False)
+        rows = np.searchsorted(base_ids_full, treated_ids)
         T_full[rows] = 1
 
     # Stratified subsample for interactivity.
     rng = np.random.default_rng(42)
     if base_ids_full.size > max_rows:
-        treated_idx = np.flatnonzero(T_full == 1)
-        control_idx = np.flatnonzero(T_full == 0)
+        # T is 0/1 int8, so a bool view is the treated mask without a compare pass.
+        treated_full = T_full.view(np.bool_)
+        treated_idx = np.flatnonzero(treated_full)
+        control_idx = np.flatnonzero(~treated_full)
 
         min_per_group = min(5_000, max_rows // 10)
         desired_treated = int(min(treated_idx.size, max(min_per_group, round(max_rows * (treated_idx.size / base_ids_full.size)))))
@@ -2894,121 +3358,64 @@ def get_item_necessity(
         sel.sort()
         base_ids = base_ids_full[sel]
         T = T_full[sel]
-        from pyroaring import BitMap
         base_bitmap_model = BitMap(base_ids)
     else:
         base_ids = base_ids_full
         T = T_full
         base_bitmap_model = base_bitmap
 
-    placements = ENGINE.placements[base_ids].astype(np.int16, copy=False)
+    treated_mask = T.view(np.bool_)
+    control_mask = ~treated_mask
+
+    placements = ENGINE.placements[base_ids]
     y, kind = placements_to_outcome(placements, outcome)
 
-    def _rates(p: np.ndarray) -> dict[str, float]:
-        n = int(p.size)
+    # Placement histograms for control/treated in one pass; base is their sum.
+    place_hist = np.bincount(
+        T.astype(np.intp) * 9 + placements.astype(np.intp, copy=False), minlength=18
+    ).reshape(2, 9)
+
+    def _rates(hist: np.ndarray) -> dict[str, float]:
+        n = int(hist.sum())
         if n == 0:
             return {"avg_placement": 4.5, "top4_rate": 0.0, "win_rate": 0.0}
         return {
-            "avg_placement": float(p.mean()),
-            "top4_rate": float((p <= 4).mean()),
-            "win_rate": float((p == 1).mean()),
+            "avg_placement": float(hist @ np.arange(9)) / n,
+            "top4_rate": float(hist[:5].sum()) / n,
+            "win_rate": float(hist[1]) / n,
         }
 
-    base_rates = _rates(placements)
-    treated_rates = _rates(placements[T == 1])
-    control_rates = _rates(placements[T == 0])
+    base_rates = _rates(place_hist.sum(axis=0))
+    treated_rates = _rates(place_hist[1])
+    control_rates = _rates(place_hist[0])
 
     # Fast path: use precomputed necessity cache when we're in the default
     # "unit present (auto 2★+)" context and Top4 outcome.
-    cache_eligible = (
-        outcome.strip().lower() in ("top4", "top_4", "topfour")
+    if (
+        not by_cluster
         and not include_filters
         and not exclude_filters
-        and not by_cluster
-        and getattr(ENGINE, "necessity_top4_ready", False)
-        and n_splits == 2
-        and max_rows == 80_000
-        and min_token_freq == 25
-        and overlap_min == 0.05
-        and overlap_max == 0.95
-    )
-    if cache_eligible:
-        tok_id = ENGINE.token_to_id.get(eq_token)
-        if tok_id is not None:
-            stored_scope = int(ENGINE.necessity_top4_scope_min_star[tok_id])
-            if stored_scope and stored_scope == int(scope.get("unit_stars_min") or 1):
-                tau = float(ENGINE.necessity_top4_tau[tok_id])
-                if np.isfinite(tau):
-                    ci_low = float(ENGINE.necessity_top4_ci95_low[tok_id])
-                    ci_high = float(ENGINE.necessity_top4_ci95_high[tok_id])
-                    se = float(ENGINE.necessity_top4_se[tok_id])
-                    raw_tau_cached = float(ENGINE.necessity_top4_raw_tau[tok_id])
-                    frac_trimmed = float(ENGINE.necessity_top4_frac_trimmed[tok_id])
-                    e_p01 = float(ENGINE.necessity_top4_e_p01[tok_id])
-                    e_p99 = float(ENGINE.necessity_top4_e_p99[tok_id])
-
-                    warnings: list[str] = []
-                    if np.isfinite(frac_trimmed) and frac_trimmed > 0.5:
-                        warnings.append("Low overlap: large fraction of samples trimmed by propensity bounds.")
-                    if np.isfinite(e_p01) and np.isfinite(e_p99) and (e_p01 < 0.02 or e_p99 > 0.98):
-                        warnings.append("Positivity warning: propensity is near 0/1 in parts of X (effect may be unstable).")
-
-                    return {
-                        "unit": unit,
-                        "item": item,
-                        "filters": filter_tokens,
-                        "scope": scope,
-                        "base": {"n": int(n_base), **{k: round(v, 6) for k, v in base_rates.items()}},
-                        "treatment": {
-                            "token": eq_token,
-                            "n_treated": int(n_treated),
-                            "n_control": int(n_control),
-                            "treated": {k: round(v, 6) for k, v in treated_rates.items()},
-                            "control": {k: round(v, 6) for k, v in control_rates.items()},
-                        },
-                        "effect": {
-                            "method": "aipw",
-                            "outcome": "top4",
-                            "kind": "binary",
-                            "tau": round(tau, 6),
-                            "ci95_low": round(ci_low, 6) if np.isfinite(ci_low) else None,
-                            "ci95_high": round(ci_high, 6) if np.isfinite(ci_high) else None,
-                            "se": round(se, 6) if np.isfinite(se) else None,
-                            "p_value": None,
-                            "raw_tau": round(raw_tau_cached, 6) if np.isfinite(raw_tau_cached) else None,
-                            "y1": None,
-                            "y0": None,
-                        },
-                        "overlap": {
-                            "n_used": int(ENGINE.necessity_top4_n_used[tok_id]),
-                            "frac_trimmed": round(frac_trimmed, 6) if np.isfinite(frac_trimmed) else None,
-                            "e_min": None,
-                            "e_p01": round(e_p01, 6) if np.isfinite(e_p01) else None,
-                            "e_p50": None,
-                            "e_p99": round(e_p99, 6) if np.isfinite(e_p99) else None,
-                            "e_max": None,
-                            "bounds": [float(overlap_min), float(overlap_max)],
-                        },
-                        "warning": None,
-                        "warnings": warnings,
-                        "cached": True,
-                    }
+        and (n_splits, max_rows, min_token_freq, overlap_min, overlap_max) == _NECESSITY_TOP4_DEFAULTS
+        and outcome.strip().lower() in ("top4", "top_4", "topfour")
+    ):
+        cached = _fast_necessity_top4(
+            unit,
+            item,
+            eq_token,
+            filter_tokens,
+            scope,
+            n_base,
+            n_treated,
+            n_control,
+            base_rates,
+            treated_rates,
+            control_rates,
+        )
+        if cached is not None:
+            return cached
 
     # Feature matrix X: sparse token presence + numeric board-strength proxies.
-    exclude = {unit_token, eq_token, item_token}
-    feature_params = TokenFeatureParams(
-        use_units=True,
-        use_traits=True,
-        use_items=False,
-        use_equipped=False,
-        include_star_units=False,
-        include_tier_traits=True,
-        min_token_freq=min_token_freq,
-    )
-    feature_tokens = select_feature_tokens(ENGINE, feature_params, exclude=exclude)
-    X_tok, kept, base_counts, feature_rows = build_sparse_feature_matrix(
-        ENGINE, base_bitmap_model, base_ids, feature_tokens
-    )
+    X_tok, kept, base_counts = _item_necessity_token_matrix(unit_token, base_bitmap_model, base_ids, min_token_freq)
 
     # Board-strength proxy features.
     #
@@ -3017,53 +3424,36 @@ def get_item_necessity(
     # Instead of using raw totals, we subtract *all* items equipped on this unit and
     # keep "rest-of-board" counts. This prevents X from trivially encoding T while
     # still controlling for overall board strength.
-    Z_full = board_strength_features(ENGINE, base_ids).astype(np.float32, copy=False)
-    unit_item_count = np.zeros((base_ids.size,), dtype=np.float32)
-    unit_component_count = np.zeros((base_ids.size,), dtype=np.float32)
-    unit_completed_count = np.zeros((base_ids.size,), dtype=np.float32)
-
-    prefix = f"E:{unit}|"
-    for eq_tok in ENGINE.id_to_token:
-        if not eq_tok.startswith(prefix):
-            continue
-        if parse_token(eq_tok).get("copies", 1) != 1:
-            continue
-        tok_id = ENGINE.token_to_id.get(eq_tok)
-        tok_stats = ENGINE.tokens.get(tok_id) if tok_id is not None else None
+    Z_full = board_strength_features(ENGINE, base_ids)
+    component_rows: list[np.ndarray] = []
+    completed_rows: list[np.ndarray] = []
+    for tok_id, is_component in ENGINE.unit_equip_index.get(unit, ()):
+        tok_stats = ENGINE.tokens.get(tok_id)
         if tok_stats is None:
             continue
         bm = base_bitmap_model & tok_stats.bitmap
         if not bm:
             continue
-        ids = np.array(bm.to_array(), dtype=np.int64)
-        rows = np.searchsorted(base_ids, ids).astype(np.int64, copy=False)
-        unit_item_count[rows] += 1.0
-
-        item_name = parse_token(eq_tok).get("item")
-        if not item_name:
-            continue
-        if get_item_type(item_name) == "component":
-            unit_component_count[rows] += 1.0
-        else:
-            unit_completed_count[rows] += 1.0
-
-    other_item_count = np.clip(Z_full[:, 0] - unit_item_count, 0.0, None)
-    other_component_count = np.clip(Z_full[:, 1] - unit_component_count, 0.0, None)
-    other_completed_count = np.clip(Z_full[:, 2] - unit_completed_count, 0.0, None)
-    Z = np.stack(
-        [
-            other_item_count,
-            other_component_count,
-            other_completed_count,
-            Z_full[:, 3],
-            Z_full[:, 4],
-            Z_full[:, 5],
-            Z_full[:, 6],
-        ],
-        axis=1,
+        ids = np.frombuffer(bm.to_array(), dtype=np.uint32)
+        rows = np.searchsorted(base_ids, ids)
+        (component_rows if is_component else completed_rows).append(rows)
+
+    # Rest-of-board counts: subtract this unit's items in place. Z_full is a fresh
+    # (n, 7) array, so it becomes Z directly without stacking a copy.
+    n_rows = int(base_ids.size)
+    unit_component_count = np.bincount(
+        np.concatenate(component_rows) if component_rows else np.zeros((0,), dtype=np.intp), minlength=n_rows
     )
-    from scipy.sparse import csr_matrix, hstack
-    X = hstack([X_tok.astype(np.float32), csr_matrix(Z, dtype=np.float32)], format="csr")
+    unit_completed_count = np.bincount(
+        np.concatenate(completed_rows) if completed_rows else np.zeros((0,), dtype=np.intp), minlength=n_rows
+    )
+    Z = Z_full
+    Z[:, 0] -= unit_component_count + unit_completed_count
+    Z[:, 1] -= unit_component_count
+    Z[:, 2] -= unit_completed_count
+    np.maximum(Z[:, :3], 0.0, out=Z[:, :3])
+
+    X = append_dense_columns(X_tok, Z)
 
     cfg = AIPWConfig(
         n_splits=n_splits,
@@ -3113,7 +3503,7 @@ def get_item_necessity(
             "warnings": warnings,
         }
 
-    raw_tau = float(y[T == 1].mean() - y[T == 0].mean())
+    raw_tau = float(y[treated_mask].mean() - y[control_mask].mean())
     warnings: list[str] = []
     if est.frac_trimmed > 0.5:
         warnings.append("Low overlap: large fraction of samples trimmed by propensity bounds.")
@@ -3177,74 +3567,89 @@ def get_item_necessity(
 
     if by_cluster and base_ids.size >= 2_000 and len(kept) >= 10:
         try:
-            from sklearn.cluster import MiniBatchKMeans
-
             # Cluster on coarse comp context (tokens only) and summarize τ(X) by cluster.
+            # Clusters only feed signature tokens, so one k-means++ init seeded from a
+            # 10k-row sketch (init_size) is enough instead of n_init=3 full restarts.
+            # X_tok is already int8 CSR; sklearn upcasts it once per fit, and feeding it
+            # float32 instead measured no faster, so it is passed through unchanged.
             kmeans = MiniBatchKMeans(
                 n_clusters=n_clusters,
                 random_state=42,
-                batch_size=2048,
-                n_init=3,
-                reassignment_ratio=0.01,
+                batch_size=4096,
+                n_init=1,
+                init_size=10_000,
+                max_iter=50,
+                reassignment_ratio=0.0,
             )
             labels = kmeans.fit_predict(X_tok)
             cluster_sizes = np.bincount(labels, minlength=n_clusters).astype(np.int32, copy=False)
             base_freq = base_counts.astype(np.float32) / float(base_ids.size) if base_ids.size else np.zeros((len(kept),), dtype=np.float32)
 
             # Precompute counts(feature present) per cluster for each feature.
-            feature_cluster_counts = np.zeros((n_clusters, len(kept)), dtype=np.int32)
-            for j, rows in enumerate(feature_rows):
-                feature_cluster_counts[:, j] = np.bincount(labels[rows], minlength=n_clusters)
-
-            def _signature(kept_features: list[str], cluster_freq: np.ndarray, base_freq: np.ndarray) -> list[str]:
-                eps = 1e-9
-                lift = cluster_freq / np.maximum(base_freq, eps)
-                score = cluster_freq * np.log2(np.maximum(lift, 1.0))
-
-                def pick(prefix: str, k: int) -> list[str]:
-                    idx = [i for i, t in enumerate(kept_features) if t.startswith(prefix)]
-                    if not idx:
-                        return []
-                    idx_sorted = sorted(idx, key=lambda i: float(score[i]), reverse=True)
-                    out: list[str] = []
-                    for i in idx_sorted:
-                        if cluster_freq[i] < 0.2:
-                            continue
-                        out.append(kept_features[i])
-                        if len(out) >= k:
-                            break
-                    return out
+            cluster_feature_counts = feature_cluster_counts(X_tok, labels, n_clusters)
+
+            # Signature scores for every cluster at once: freq * log2(max(lift, 1)).
+            cluster_freq_all = cluster_feature_counts.astype(np.float32) / np.maximum(cluster_sizes, 1).astype(np.float32)[:, None]
+            # Built in one buffer: lift -> max(lift, 1) -> log2 -> * freq.
+            score_all = np.divide(cluster_freq_all, np.maximum(base_freq, 1e-9))
+            np.maximum(score_all, 1.0, out=score_all)
+            np.log2(score_all, out=score_all)
+            np.multiply(score_all, cluster_freq_all, out=score_all)
+            prefix_idx = {
+                prefix: np.fromiter((i for i, t in enumerate(kept) if t.startswith(prefix)), dtype=np.intp)
+                for prefix in ("U:", "T:", "I:")
+            }
 
+            def _signature(c: int) -> list[str]:
                 sig: list[str] = []
-                sig.extend(pick("U:", 4))
-                sig.extend(pick("T:", 3))
-                sig.extend(pick("I:", 2))
-                seen: set[str] = set()
-                ordered: list[str] = []
-                for t in sig:
-                    if t in seen:
+                for prefix, k in (("U:", 4), ("T:", 3), ("I:", 2)):
+                    idx = prefix_idx[prefix]
+                    if not idx.size:
                         continue
-                    seen.add(t)
-                    ordered.append(t)
-                return ordered
+                    # Stable descending order matches sorted(..., reverse=True) on ties.
+                    idx = idx[np.argsort(-score_all[c, idx], kind="stable")]
+                    idx = idx[cluster_freq_all[c, idx] >= 0.2][:k]
+                    sig.extend(kept[i] for i in idx)
+                return sig
+
+            # Per-cluster tau/SE over used rows in one grouped pass (two-pass variance).
+            labels_used = labels[used]
+            phi_used = phi[used]
+            n_used_by_c = np.bincount(labels_used, minlength=n_clusters)
+            phi_sum = np.bincount(labels_used, weights=phi_used, minlength=n_clusters)
+            tau_by_c = phi_sum / np.maximum(n_used_by_c, 1)
+            resid = phi_used - tau_by_c[labels_used]
+            ss_by_c = np.bincount(labels_used, weights=resid * resid, minlength=n_clusters)
+
+            # Propensity p10/p50/p90 for every cluster from one (label, e_hat) sort: each
+            # cluster is a sorted contiguous slice, so np.quantile's linear interpolation
+            # reduces to index arithmetic.
+            e_sorted = e_hat[np.lexsort((e_hat, labels))]
+            bounds = np.zeros((n_clusters + 1,), dtype=np.int64)
+            np.cumsum(cluster_sizes, out=bounds[1:])
+            virt = (np.maximum(cluster_sizes, 1) - 1).astype(np.float64)[:, None] * np.array([0.1, 0.5, 0.9])
+            lo = np.floor(virt)
+            gamma = virt - lo
+            last = max(int(e_sorted.size) - 1, 0)
+            lo_idx = np.minimum(bounds[:-1, None] + lo.astype(np.int64), last)
+            hi_idx = np.minimum(np.minimum(lo_idx + 1, bounds[1:, None] - 1), last)
+            e_lo = e_sorted[lo_idx]
+            e_hi = e_sorted[hi_idx]
+            diff = e_hi - e_lo
+            e_qs = np.where(gamma >= 0.5, e_hi - diff * (1.0 - gamma), e_lo + diff * gamma)
 
             clusters_out: list[dict] = []
             for c in range(n_clusters):
                 size = int(cluster_sizes[c])
                 if size < 250:
                     continue
-                in_c = labels == c
-                used_c = used & in_c
-                n_used_c = int(used_c.sum())
+                n_used_c = int(n_used_by_c[c])
                 if n_used_c < 200:
                     continue
 
-                cluster_counts = feature_cluster_counts[c].astype(np.float32, copy=False)
-                cluster_freq = cluster_counts / float(size)
-                tau_c = float(phi[used_c].mean())
-                se_c = float(phi[used_c].std(ddof=1) / np.sqrt(n_used_c)) if n_used_c > 1 else float("nan")
-                e_c = e_hat[in_c]
-                qs = np.quantile(e_c, [0.1, 0.5, 0.9])
+                tau_c = float(tau_by_c[c])
+                se_c = float(np.sqrt(ss_by_c[c] / (n_used_c - 1)) / np.sqrt(n_used_c)) if n_used_c > 1 else float("nan")
+                qs = e_qs[c]
 
                 clusters_out.append(
                     {
@@ -3259,7 +3664,7 @@ def get_item_necessity(
                         "e_p10": round(float(qs[0]), 6),
                         "e_p50": round(float(qs[1]), 6),
                         "e_p90": round(float(qs[2]), 6),
-                        "signature_tokens": _signature(kept, cluster_freq, base_freq),
+                        "signature_tokens": _signature(c),
                     }
                 )
 
@@ -3286,7 +3691,6 @@ app.mount("/static", StaticFiles(directory=str(static_path)), name="static")
 
 @app.get("/riot.txt")
 def riot_verification():
-    from fastapi.responses import PlainTextResponse
     return PlainTextResponse("78b19ad2-1989-43e3-93e6-96e803af504c")
 
 
@@ -3302,9 +3706,8 @@ def read_changelog():
 
 
 def main():
-    import os
     port = int(os.environ.get("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    uvicorn.run(app, host="0.0.0.0", port=port, loop="uvloop", http="httptools")
 
 
 if __name__ == "__main__":